@@ -83,10 +83,12 @@ class _Backup(object):
 
     def _purge(self):
         expires = datetime.datetime.utcnow() - cfg.keep_days
+        old = []
         for d in pkio.sorted_glob('[0-9]' * len(self._date_d)):
             t = datetime.datetime.utcfromtimestamp(d.stat().mtime)
             if t < expires:
-                pkio.unchecked_remove(d)
+                old.append(d)
+        pkio.unchecked_remove(*old, parallel=True)
 
     def _repo(self, repo):
         fn = repo.full_name
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+u"""Manage jinja2 templates
+
+:copyright: Copyright (c) 2018 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+
+
+def precompile(package='pykern'):
+    """Compile all templates in package_data into the bytecode cache
+
+    Run after install (or at container build time) so processes
+    don't compile templates on first render. Requires
+    ``PYKERN_PKJINJA_BYTECODE_CACHE_DIR`` to be set.
+
+    Args:
+        package (str): root package containing templates [pykern]
+
+    Returns:
+        str: number of templates compiled
+    """
+    from pykern import pkcli
+    from pykern import pkio
+    from pykern import pkjinja
+    from pykern import pkresource
+    import importlib
+
+    if not pkjinja.cfg.bytecode_cache_dir:
+        pkcli.command_error('PYKERN_PKJINJA_BYTECODE_CACHE_DIR must be set')
+    res = 0
+    for f in pkio.walk_tree(
+        pkresource.filename('', importlib.import_module(package)),
+        r'\.jinja$',
+    ):
+        pkjinja.compile_file(f)
+        res += 1
+    return '{}: templates compiled'.format(res)
@@ -122,15 +122,16 @@ def init_tree(name, author, author_email, description, license, url):
     })
     values['copyright_license_rst'] = values['copyright_license_rst'].format(**values)
     suffix_re = r'\.jinja$'
+    jobs = []
     for src in pkio.walk_tree(base, file_re=suffix_re):
         dst = py.path.local(src).relto(str(base))
         dst = dst.replace('projex', name).replace('dot-', '.')
         dst = re.sub(suffix_re, '', dst)
         pkio.mkdir_parent_only(dst)
-        _render(src, values, output=dst)
+        jobs.append((values, dst, src))
     src = py.path.local(pkresource.filename('projex-licenses'))
-    src = src.join(license + '.jinja')
-    _render(src, values, output='LICENSE')
+    jobs.append((values, 'LICENSE', src.join(license + '.jinja')))
+    _render(jobs)
 
 
 def _license(name, which):
@@ -144,7 +145,12 @@ def _license(name, which):
             ' '.join(sorted(LICENSES.values())),
         )
 
-def _render(*args, **kwargs):
-    """Renders the template and adds to git"""
-    pkjinja.render_file(*args, **kwargs)
-    subprocess.check_call(['git', 'add', kwargs['output']])
+def _render(jobs):
+    """Renders the templates and adds to git"""
+    err = pkjinja.render_many(None, jobs)
+    if err:
+        pkcli.command_error(
+            '{}',
+            '; '.join('{}: {}'.format(o, e) for o, e in err),
+        )
+    subprocess.check_call(['git', 'add'] + [j[1] for j in jobs])
@@ -68,7 +68,8 @@ def add_code(name, version, uri, source_d, virtual_env=None, pyenv=None):
         version=version,
     )
     values.codes[pyenv] = v
-    pkjson.dump_pretty(values, filename=fn)
+    # Readers in other processes must not see a partially written file
+    pkjson.dump_pretty(values, filename=fn, atomic=True)
 
 
 def pkunit_setup():
@@ -11,7 +11,6 @@ a OrderedMapping don't collide.
 """
 from __future__ import absolute_import, division, print_function
 # Avoid pykern imports so avoid dependency issues for pkconfig
-import json
 
 class Dict(dict):
     """A subclass of dict that allows items to be read/written as attributes.
@@ -83,6 +82,27 @@ class DictNameError(NameError):
     pass
 
 
+class FrozenDict(Dict):
+    """A `Dict` which cannot be modified after it is created.
+
+    Values are not frozen by this class. Nest `FrozenDict` and
+    `tuple` to create a deep-frozen tree. Because the contents
+    never change, computed results (e.g. `pykern.pkjson.canonical_hash`)
+    may be cached on the object.
+
+    Modifying operations raise `TypeError`.
+    """
+    def __reduce__(self):
+        # dict's default reduce populates the object with __setitem__
+        return (type(self), (dict(self),))
+
+    def _frozen(self, *args, **kwargs):
+        raise TypeError('{}: cannot be modified'.format(type(self).__name__))
+
+    __delitem__ = __ior__ = __setattr__ = __setitem__ = _frozen
+    clear = pop = popitem = setdefault = update = _frozen
+
+
 class OrderedMapping(object):
     """Ordered mapping can be initialized by kwargs or single argument.
 
@@ -183,9 +203,49 @@ class OrderedMapping(object):
         setattr(self, key, value)
 
 
+def freeze(value):
+    """Deep copy dicts and lists as `FrozenDict` and tuples
+
+    Walks iteratively so deeply nested values don't hit the
+    recursion limit. Scalars are not copied. Values which appear more
+    than once (e.g. YAML aliases) are frozen once and shared.
+
+    Args:
+        value (object): dict, list, tuple, or scalar
+
+    Returns:
+        object: frozen copy of value
+    """
+    res = {}
+    # ids of containers whose children are being frozen
+    active = set()
+    stack = [(value, False)]
+    f = lambda x: res.get(id(x), x)
+    while stack:
+        v, done = stack.pop()
+        i = id(v)
+        if done:
+            active.discard(i)
+            if isinstance(v, dict):
+                res[i] = FrozenDict((k, f(x)) for k, x in v.items())
+            else:
+                res[i] = tuple(f(x) for x in v)
+            continue
+        if not isinstance(v, (dict, list, tuple)) or i in res:
+            continue
+        if i in active:
+            raise ValueError('value contains itself, cannot freeze')
+        active.add(i)
+        stack.append((v, True))
+        stack.extend((x, False) for x in (v.values() if isinstance(v, dict) else v))
+    return f(value)
+
+
 def json_load_any(obj, *args, **kwargs):
     """Read json file or str with ``object_pairs_hook=Dict``
 
+    See `pykern.pkjson.load_any`, which selects the decoder.
+
     Args:
         obj (object): str or object with "read"
         args (tuple): passed verbatim
@@ -194,9 +254,10 @@ def json_load_any(obj, *args, **kwargs):
     Returns:
         object: parsed JSON
     """
-    kwargs.setdefault('object_pairs_hook', object_pairs_hook)
-    o = obj.read() if hasattr(obj, 'read') else obj
-    return json.loads(o, *args, **kwargs)
+    # pkjson does not import pykern modules at load time
+    from pykern import pkjson
+
+    return pkjson.load_any(obj, *args, **kwargs)
 
 
 def map_items(value, op=None):
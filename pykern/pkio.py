@@ -10,7 +10,9 @@ import contextlib
 import copy
 import errno
 import glob
+import hashlib
 import io
+import json
 import locale
 import os
 import os.path
@@ -18,10 +20,100 @@ import py
 import re
 import shutil
 import six
+import stat as stat_module
+import tempfile
+import threading
+
+#: Written by `hash_tree` in the directory it hashes
+HASH_CACHE_BASENAME = '.pkio-hash-cache.json'
 
 #: used during unit testing see ``pykern.pkunit.save_chdir``
 pkunit_prefix = None
 
+#: Default size of reads by `iter_records`
+READ_BUFFER_SIZE = 1 << 20
+
+#: Number of threads used by `unchecked_remove` with parallel
+REMOVE_WORKERS = 16
+
+#: Hidden directories created by `unchecked_remove` with background
+_REMOVE_PREFIX = '.pkio-remove-'
+
+#: Default number of threads used by `scan_tree` (listing is I/O bound)
+SCAN_TREE_WORKERS = 16
+
+
+@contextlib.contextmanager
+def atomic_open(filename, mode='w', fsync=False, buffering=-1):
+    """Open a temporary file, which is renamed to filename on success
+
+    The temporary file is in the same directory as `filename` so the
+    rename is atomic. Concurrent readers see the old or the new file,
+    never a partial one. If the block raises, the temporary file is
+    removed and `filename` is untouched. Permissions are copied from
+    `filename`, if it exists.
+
+    Args:
+        filename (str or py.path.Local): file to replace
+        mode (str): "w" (text with preferred encoding) or "wb" ["w"]
+        fsync (bool): fsync the file before and the directory after rename [False]
+        buffering (int): passed to `io.open` [-1]
+
+    Yields:
+        file: open for writing
+    """
+    fn = py_path(filename)
+    d = fn.dirname
+    fd, tmp = tempfile.mkstemp(dir=d, prefix='.' + fn.basename + '-', suffix='.tmp')
+    try:
+        try:
+            m = os.stat(str(fn)).st_mode & 0o7777
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            m = 0o666 & ~_UMASK
+        os.chmod(tmp, m)
+        with io.open(
+            fd,
+            mode,
+            buffering=buffering,
+            encoding=None if 'b' in mode else locale.getpreferredencoding(),
+        ) as f:
+            fd = None
+            yield f
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        # os.rename does not replace on Windows, but os.replace is not in PY2
+        getattr(os, 'replace', os.rename)(tmp, str(fn))
+        tmp = None
+        if fsync:
+            _fsync_dir(d)
+    finally:
+        if fd is not None:
+            os.close(fd)
+        if tmp:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+
+def copy_file(src, dst):
+    """Copy contents, mode, and times of src to dst
+
+    Uses `os.copy_file_range` or `os.sendfile`, if available, so the
+    data isn't copied through user space. dst is replaced atomically.
+
+    Args:
+        src (str or py.path.Local): file to copy
+        dst (str or py.path.Local): file to write
+
+    Returns:
+        int: bytes copied
+    """
+    return _copy_file(str(py_path(src)), str(py_path(dst)))
+
 
 def exception_is_not_found(exc):
     """True if exception is IOError and ENOENT
@@ -49,6 +141,42 @@ def expand_user_path(path):
     return py_path(path)
 
 
+def glob_tree(dirname, include, exclude=None, lazy=False):
+    """Find files under dirname matching glob patterns in one traversal
+
+    Patterns are relative to dirname and match files only. ``*``, ``?``,
+    and ``[...]`` do not match "/". ``**`` matches any number of
+    directories, e.g. ``**/*.py`` matches ``a.py`` and ``x/y/a.py``.
+    Directories matching an exclude pattern (e.g. ``build`` or ``**/.git``)
+    are not traversed.
+
+    Args:
+        dirname (str or py.path.Local): directory to search
+        include (str or list): patterns of files to return
+        exclude (str or list): patterns of files or directories to skip [None]
+        lazy (bool): yield in `iter_tree` order instead of returning a sorted list [False]
+
+    Returns:
+        object: generator (lazy) or list of py.path.Local
+    """
+    i = _glob_re(include)
+    e = None
+    if exclude:
+        e = _glob_re(exclude)
+        # Excluded files are rejected by the same regex
+        i = '(?!' + e + ')' + i
+    res = (
+        _local(p) for p in iter_tree(
+            dirname,
+            file_re=re.compile(i),
+            dir_filter=e and _glob_dir_filter(re.compile(e)),
+        )
+    )
+    if lazy:
+        return res
+    return sorted(res)
+
+
 def has_file_extension(filename, to_check):
     """if matches any of the file extensions
 
@@ -65,6 +193,167 @@ def has_file_extension(filename, to_check):
     return e in to_check
 
 
+def hash_file(filename, algorithm='sha256', buffer_size=None):
+    """Hash contents of filename
+
+    Args:
+        filename (str or py.path.Local): file to read
+        algorithm (str): name passed to `hashlib.new` [sha256]
+        buffer_size (int): size of reads [`READ_BUFFER_SIZE`]
+
+    Returns:
+        str: hexdigest
+    """
+    return _hash_file(str(py_path(filename)), algorithm, buffer_size)
+
+
+def hash_tree(dirname, algorithm='sha256', cache=True, workers=None):
+    """Hash all files under dirname and find which changed
+
+    With cache, `HASH_CACHE_BASENAME` in dirname records the inode, size,
+    mtime (ns), and hash of each file. Files whose inode, size, and mtime
+    are unchanged are not read. Symlinks are followed so these are of the
+    target, and dangling symlinks are skipped. Changes are relative to the
+    cache so without it (or if it can't be parsed), all files are changed.
+    The cache is not written if dirname isn't writable.
+
+    Args:
+        dirname (str or py.path.Local): directory to hash
+        algorithm (str): name passed to `hashlib.new` [sha256]
+        cache (bool): read and write `HASH_CACHE_BASENAME` [True]
+        workers (int): number of files to hash in parallel [1]
+
+    Returns:
+        tuple: (hexdigest of tree, sorted list of changed, added, or removed relative paths)
+    """
+    dn = str(py_path(dirname).realpath())
+    cf = os.path.join(dn, HASH_CACHE_BASENAME)
+    prev = _hash_tree_cache(cf, algorithm) if cache else {}
+    files = {}
+    todo = []
+    for p, s in scan_tree(dn, stat=True):
+        r = os.path.relpath(p, dn).replace(os.sep, '/')
+        if r == HASH_CACHE_BASENAME:
+            continue
+        s = _stat_target(p, s)
+        if s is None:
+            continue
+        k = [s.st_ino, s.st_size, _mtime_ns(s)]
+        x = prev.get(r)
+        if x and x[:3] == k:
+            files[r] = x
+        else:
+            todo.append((r, p, k))
+    if todo:
+        def _hash(t):
+            return _hash_file(t[1], algorithm, None)
+
+        if workers and workers > 1:
+            with _pool(workers) as p:
+                h = p.map(_hash, todo)
+        else:
+            h = [_hash(t) for t in todo]
+        for t, x in zip(todo, h):
+            files[t[0]] = t[2] + [x]
+    res = hashlib.new(algorithm)
+    changed = []
+    for r in sorted(files):
+        res.update((r + u'\0' + files[r][3] + u'\n').encode('utf-8'))
+        if r not in prev or prev[r][3] != files[r][3]:
+            changed.append(r)
+    changed = sorted(changed + [r for r in prev if r not in files])
+    if cache and files != prev:
+        try:
+            with atomic_open(cf) as f:
+                f.write(pkcompat.locale_str(json.dumps(
+                    {'algorithm': algorithm, 'files': files},
+                    sort_keys=True,
+                )))
+        except (IOError, OSError):
+            # e.g. read-only tree; the next call hashes again
+            pass
+    return res.hexdigest(), changed
+
+
+def iter_records(filename, separator=b'\n', record_size=None, buffer_size=None):
+    """Generate records (bytes) from filename without reading it all
+
+    Records end with (and include) separator, except possibly the last.
+    With record_size, records are fixed size, and separator is ignored.
+
+    Args:
+        filename (str or py.path.Local): file to read
+        separator (bytes): end of record [newline]
+        record_size (int): length of each record [None]
+        buffer_size (int): size of reads [`READ_BUFFER_SIZE`]
+
+    Yields:
+        bytes: each record
+    """
+    b = buffer_size or READ_BUFFER_SIZE
+    if record_size:
+        # Read whole records
+        b = max(b // record_size, 1) * record_size
+    with io.open(str(py_path(filename)), 'rb', buffering=0) as f:
+        rest = b''
+        while True:
+            c = f.read(b)
+            if not c:
+                break
+            if rest:
+                c = rest + c
+            if record_size:
+                n = len(c) - len(c) % record_size
+                for i in range(0, n, record_size):
+                    yield c[i:i + record_size]
+                rest = c[n:]
+                continue
+            x = c.split(separator)
+            rest = x.pop()
+            for r in x:
+                yield r + separator
+        if rest:
+            yield rest
+
+
+def iter_tree(dirname, file_re=None, dir_filter=None):
+    """Generate files (only) under dirname, top down
+
+    Unlike `walk_tree`, paths are strs, which are yielded as they are
+    found, and the order is sorted within each directory (a directory's
+    files come before or after a subdirectory's by name), not overall.
+    Symbolic links to directories are not followed or returned.
+
+    Args:
+        dirname (str or py.path.Local): directory to walk
+        file_re (re or str): only yield files whose path relative to dirname matches
+        dir_filter (callable): passed path of directory relative to dirname; return False to skip it
+
+    Yields:
+        str: absolute paths
+    """
+    fr = file_re
+    if fr and not hasattr(fr, 'search'):
+        fr = re.compile(fr)
+    dn = str(py_path(dirname).realpath())
+    # frames are (directory, relative prefix, iterator of entries)
+    stack = [(dn, '', iter(_scandir(dn)))]
+    while stack:
+        d, p, entries = stack[-1]
+        for n, is_dir, is_link in entries:
+            r = p + n
+            if is_dir:
+                if is_link or dir_filter and not dir_filter(r):
+                    continue
+                n = os.path.join(d, n)
+                stack.append((n, r + '/', iter(_scandir(n))))
+                break
+            if not fr or fr.search(r):
+                yield os.path.join(d, n)
+        else:
+            stack.pop()
+
+
 def mkdir_parent(path):
     """Create the directories and their parents (if necessary)
 
@@ -89,12 +378,35 @@ def mkdir_parent_only(path):
     return mkdir_parent(py_path(path).dirname)
 
 
+def mmap_file(filename):
+    """Map filename into memory read-only
+
+    The result supports the buffer protocol, e.g. ``numpy.frombuffer``
+    or ``memoryview(m).cast('d')``. Call ``close`` (or use ``with``)
+    when done. Empty files can't be mapped so the result is an empty
+    buffer, which also has ``close`` and supports ``with``.
+
+    Args:
+        filename (str or py.path.Local): file to map
+
+    Returns:
+        mmap.mmap: read-only buffer
+    """
+    import mmap
+
+    with io.open(str(py_path(filename)), 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return _EmptyMmap()
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
 def py_path(path=None):
     """Creates a py.path.Local object
 
     Will expanduser, if needed.
 
-    If `pkunit_prefix` is set, will prefix, too.
+    If `pkunit_prefix` is set, will prefix, too, and create the
+    parent directory.
 
     Args:
         path (str): path to convert (or None for current dir)
@@ -102,16 +414,22 @@ def py_path(path=None):
     Returns:
         py.path.Local: path
     """
-    global pkunit_prefix
+    if not pkunit_prefix and isinstance(path, py.path.local):
+        return path
+    return _local(_resolve(path))
 
-    res = py.path.local(path, expanduser=True)
-    if pkunit_prefix:
-        # Allow for <test>_work and <test>_data so we don't add
-        # prefix if there's a common parent directory.
-        if not str(res).startswith(pkunit_prefix.dirname):
-            res = pkunit_prefix.join(res)
-        py.path.local(res.dirname).ensure(dir=True)
-    return res
+
+def read_binary(filename):
+    """Open file, read bytes, and close.
+
+    Args:
+        filename (str or py.path.Local): File to open
+
+    Returns:
+        bytes: contents of `filename`
+    """
+    with io.open(str(py_path(filename)), 'rb') as f:
+        return f.read()
 
 
 def read_text(filename):
@@ -161,6 +479,44 @@ def save_chdir(dirname, mkdir=False, is_pkunit_prefix=False):
             pkunit_prefix = prev_ppp
 
 
+def scan_tree(dirname, file_re=None, dir_filter=None, stat=False, workers=None):
+    """List files (only) under dirname with directories read in parallel
+
+    Directories are listed (and files are stat'ed) level by level on a
+    thread pool, which helps on network filesystems where latency per
+    directory dominates. See `iter_tree` for arguments.
+
+    Args:
+        dirname (str or py.path.Local): directory to walk
+        file_re (re or str): only return files whose path relative to dirname matches
+        dir_filter (callable): passed path of directory relative to dirname; return False to skip it
+        stat (bool): return `os.lstat` of each file, too [False]
+        workers (int): maximum concurrent directory reads [`SCAN_TREE_WORKERS`]
+
+    Returns:
+        list: absolute paths (str) or (path, os.stat_result) if stat, sorted by path
+    """
+    fr = file_re
+    if fr and not hasattr(fr, 'search'):
+        fr = re.compile(fr)
+    res = []
+    dirs = [(str(py_path(dirname).realpath()), '')]
+    with _pool(workers or SCAN_TREE_WORKERS) as p:
+        while dirs:
+            n = []
+            for d, entries in p.map(lambda x: _scan_dir(x, stat), dirs):
+                for e in entries:
+                    r = d[1] + e[0]
+                    if e[1]:
+                        if not e[2] and (not dir_filter or dir_filter(r)):
+                            n.append((os.path.join(d[0], e[0]), r + '/'))
+                    elif not fr or fr.search(r):
+                        f = os.path.join(d[0], e[0])
+                        res.append((f, e[3]) if stat else f)
+            dirs = n
+    return sorted(res)
+
+
 def sorted_glob(path):
     """sorted list of py.path.Local objects, non-recursive
 
@@ -170,37 +526,121 @@ def sorted_glob(path):
     Returns:
         list: py.path.Local objects
     """
-    return sorted(py_path(f) for f in glob.glob(str(path)))
+    e = set()
+    return [_local(p) for p in sorted(_resolve(f, e) for f in glob.glob(str(path)))]
+
 
+def sync_tree(src, dst, workers=None, progress=None):
+    """Copy files in src to dst, which are missing or differ in dst
 
-def unchecked_remove(*paths):
+    Files are the same if their sizes and modification times match
+    (`copy_file` preserves the time). Symlinks in src are followed, and
+    dangling symlinks are skipped. Files in dst which aren't in src are
+    not removed.
+
+    Args:
+        src (str or py.path.Local): directory to copy
+        dst (str or py.path.Local): directory to update (created if needed)
+        workers (int): number of files to copy in parallel [1]
+        progress (callable): passed (relative path, bytes copied, total bytes) after each file [None]
+
+    Returns:
+        list: relative paths of files copied in sorted order
+    """
+    s = str(py_path(src).realpath())
+    d = str(py_path(dst))
+    jobs = []
+    total = 0
+    for p, x in scan_tree(s, stat=True):
+        # Compare what _copy_file reads
+        x = _stat_target(p, x)
+        if x is None:
+            continue
+        r = os.path.relpath(p, s)
+        t = os.path.join(d, r)
+        try:
+            y = os.stat(t)
+            if y.st_size == x.st_size and _mtime_ns(y) == _mtime_ns(x):
+                continue
+        except OSError:
+            pass
+        jobs.append((p, t, r))
+        total += x.st_size
+    lock = threading.Lock()
+    done = [0]
+
+    def _copy(j):
+        try:
+            os.makedirs(os.path.dirname(j[1]))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        n = _copy_file(j[0], j[1])
+        if progress:
+            with lock:
+                done[0] += n
+                progress(j[2], done[0], total)
+
+    if workers and workers > 1:
+        with _pool(workers) as p:
+            p.map(_copy, jobs)
+    else:
+        for j in jobs:
+            _copy(j)
+    return [j[2] for j in jobs]
+
+
+def unchecked_remove(*paths, **kwargs):
     """Remove files or directories, ignoring OSError.
 
     Will not remove '/' or '.'
 
+    With parallel, the entries of each directory are removed by
+    `REMOVE_WORKERS` threads. With background, each directory is renamed
+    to a hidden name in its parent and removed by a (non-daemon) thread
+    so this returns immediately. Hidden directories left in the same
+    parents by interrupted processes are removed, too.
+
     Args:
         paths (str): paths to remove
+        background (bool): remove directories in a thread [False]
+        parallel (bool): remove entries of directories in parallel [False]
     """
-    cwd = py_path()
+    background = kwargs.pop('background', False)
+    parallel = kwargs.pop('parallel', False)
+    assert not kwargs, \
+        '{}: unknown arguments'.format(kwargs)
+    e = set()
+    cwd = _resolve(None, e)
+    dirs = []
     for a in paths:
-        p = py_path(a)
-        assert len(p.parts()) > 1, \
+        p = _resolve(a, e)
+        assert p != os.path.dirname(p), \
             '{}: will not remove root directory'.format(p)
         assert cwd != p, \
             '{}: will not remove current directory'.format(p)
         try:
             os.remove(str(a))
         except OSError:
-            try:
-                shutil.rmtree(str(a), ignore_errors=True)
-            except OSError:
-                pass
+            dirs.append(_rename_to_remove(str(a)) if background else str(a))
+    if background:
+        dirs = [d for d in dirs if d]
+        if dirs:
+            dirs = sorted(set(dirs + [
+                x for d in dirs for x in glob.glob(
+                    os.path.join(os.path.dirname(os.path.abspath(d)), _REMOVE_PREFIX + '*'),
+                )
+            ]))
+            threading.Thread(target=_remove_dirs, args=(dirs, parallel)).start()
+    else:
+        _remove_dirs(dirs, parallel)
 
 
 def walk_tree(dirname, file_re=None):
     """Return list files (only) as py.path's, top down, sorted
 
-    If you want to go bottom up, just reverse the list.
+    If you want to go bottom up, just reverse the list. For large trees,
+    use `iter_tree`, which doesn't build the whole list.
 
     Args:
         dirname (str): directory to walk
@@ -209,33 +649,388 @@ def walk_tree(dirname, file_re=None):
     Yields:
         py.path.local: paths in sorted order
     """
-    fr = file_re
-    if fr and not hasattr(fr, 'search'):
-        fr = re.compile(fr)
-    dirname = py_path(dirname).realpath()
-    dn = str(dirname)
-    res = []
-    for r, d, files in os.walk(dn, topdown=True, onerror=None, followlinks=False):
-        for f in files:
-            p = py_path(r).join(f)
-            if fr and not fr.search(dirname.bestrelpath(p)):
-                continue
-            res.append(p)
     # Not an iterator, but works as one. Don't assume always will return list
-    return sorted(res)
+    return [_local(p) for p in sorted(iter_tree(dirname, file_re))]
 
 
-def write_text(filename, contents):
+def write_text(filename, contents, atomic=False, fsync=False):
     """Open file, write text with preferred encoding, and close.
 
+    With `atomic`, readers see either the old or the new contents,
+    never a partially written file. See `atomic_open`.
+
     Args:
         filename (str or py.path.Local): File to open
         contents (str): New contents
+        atomic (bool): write to a temporary file and rename [False]
+        fsync (bool): flush to disk (and the directory, if `atomic`) before returning [False]
 
     Returns:
         py.path.local: `filename` as :class:`py.path.Local`
     """
     fn = py_path(filename)
-    with io.open(str(fn), 'w', encoding=locale.getpreferredencoding()) as f:
+    if atomic:
+        c = atomic_open(fn, fsync=fsync)
+    else:
+        c = io.open(str(fn), 'w', encoding=locale.getpreferredencoding())
+    with c as f:
         f.write(pkcompat.locale_str(contents))
+        if fsync and not atomic:
+            f.flush()
+            os.fsync(f.fileno())
     return fn
+
+
+class _EmptyMmap(bytes):
+    """What `mmap_file` returns for an empty file"""
+
+    closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.closed = True
+
+
+def _copy_fd(src, dst, size):
+    """Copy size bytes with the fastest method available
+
+    Returns:
+        int: bytes copied
+    """
+    res = 0
+    for f in (
+        # (dst, src) are swapped to match sendfile
+        getattr(os, 'copy_file_range', None) and (lambda o, i, n: os.copy_file_range(i, o, n)),
+        getattr(os, 'sendfile', None) and (lambda o, i, n: os.sendfile(o, i, res, n)),
+    ):
+        if not f:
+            continue
+        try:
+            while res < size:
+                n = f(dst, src, size - res)
+                if not n:
+                    return res
+                res += n
+            return res
+        except OSError as e:
+            # Not supported for these files, e.g. different filesystems
+            if res or e.errno not in (
+                errno.EBADF, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.EXDEV,
+            ):
+                raise
+    b = bytearray(min(size, READ_BUFFER_SIZE) or 1)
+    m = memoryview(b)
+    with io.open(src, 'rb', buffering=0, closefd=False) as i, \
+        io.open(dst, 'wb', buffering=0, closefd=False) as o:
+        while True:
+            n = i.readinto(b)
+            if not n:
+                return res
+            o.write(m[:n])
+            res += n
+
+
+def _copy_file(src, dst):
+    """Implements `copy_file` with strs"""
+    with io.open(src, 'rb', buffering=0) as i:
+        s = os.fstat(i.fileno())
+        with atomic_open(dst, 'wb') as o:
+            res = _copy_fd(i.fileno(), o.fileno(), s.st_size)
+            os.fchmod(o.fileno(), s.st_mode & 0o7777)
+    if hasattr(s, 'st_mtime_ns'):
+        os.utime(dst, ns=(s.st_atime_ns, s.st_mtime_ns))
+    else:
+        os.utime(dst, (s.st_atime, s.st_mtime))
+    return res
+
+
+def _fsync_dir(dirname):
+    """Flush directory entries (e.g. a rename) to disk"""
+    fd = os.open(str(dirname), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _glob_dir_filter(exclude):
+    """Directory is traversed unless it or its contents are excluded"""
+    return lambda r: not (exclude.search(r) or exclude.search(r + '/'))
+
+
+def _glob_re(patterns):
+    """Convert glob patterns to a regex which matches any of them
+
+    Returns:
+        str: anchored regex
+    """
+    if isinstance(patterns, six.string_types):
+        patterns = [patterns]
+    res = []
+    for p in patterns:
+        x = ''
+        i = 0
+        while i < len(p):
+            c = p[i]
+            i += 1
+            if c == '*':
+                if p.startswith('*/', i):
+                    x += '(?:.*/)?'
+                    i += 2
+                elif p.startswith('*', i):
+                    x += '.*'
+                    i += 1
+                else:
+                    x += '[^/]*'
+            elif c == '?':
+                x += '[^/]'
+            elif c == '[':
+                # Like fnmatch.translate: "]" is literal after "[" or "[!"
+                j = i
+                if p.startswith('!', j):
+                    j += 1
+                if p.startswith(']', j):
+                    j += 1
+                j = p.find(']', j)
+                if j < 0:
+                    x += re.escape(c)
+                    continue
+                r = p[i:j].replace('\\', '\\\\')
+                if r.startswith('!'):
+                    r = '^' + r[1:]
+                elif r.startswith('^'):
+                    r = '\\' + r
+                x += '[' + r + ']'
+                i = j + 1
+            else:
+                x += re.escape(c)
+        res.append(x)
+    return '^(?:' + '|'.join(res) + ')$'
+
+
+def _hash_file(path, algorithm, buffer_size):
+    """Implements `hash_file` with a reusable buffer"""
+    res = hashlib.new(algorithm)
+    b = bytearray(buffer_size or READ_BUFFER_SIZE)
+    m = memoryview(b)
+    with io.open(path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(b)
+            if not n:
+                break
+            res.update(m[:n])
+    return res.hexdigest()
+
+
+def _hash_tree_cache(path, algorithm):
+    """Read `HASH_CACHE_BASENAME` or empty if missing, invalid, or other algorithm"""
+    try:
+        with io.open(path, 'r', encoding='utf-8') as f:
+            c = json.load(f)
+        if c['algorithm'] != algorithm:
+            return {}
+        res = c['files']
+        for x in res.values():
+            if len(x) != 4:
+                raise ValueError('invalid entry')
+        return res
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return {}
+
+
+def _local(path):
+    """py.path.local from an absolute, normalized path (without normalizing again)"""
+    res = object.__new__(py.path.local)
+    res.strpath = path
+    return res
+
+
+def _mtime_ns(stat):
+    """Modification time in nanoseconds from stat result"""
+    return getattr(stat, 'st_mtime_ns', None) or int(stat.st_mtime * 1e9)
+
+
+@contextlib.contextmanager
+def _pool(workers, processes=False):
+    """Thread (or process) pool, which is closed and joined on exit
+
+    Args:
+        workers (int): size of pool (None: number of cpus)
+        processes (bool): `multiprocessing.Pool` instead of threads [False]
+
+    Yields:
+        multiprocessing.pool.Pool: pool
+    """
+    import multiprocessing.pool
+
+    res = (multiprocessing.Pool if processes else multiprocessing.pool.ThreadPool)(workers)
+    try:
+        yield res
+    finally:
+        res.close()
+        res.join()
+
+
+def _remove_dirs(dirs, parallel):
+    """Remove dirs, optionally removing each one's entries in parallel"""
+    if not parallel:
+        for d in dirs:
+            # Uses fd-relative unlinks on platforms which support them
+            shutil.rmtree(d, ignore_errors=True)
+        return
+    with _pool(REMOVE_WORKERS) as p:
+        for d in dirs:
+            p.map(
+                _remove_entry,
+                [(os.path.join(d, e[0]), e[1] and not e[2]) for e in _scandir(d)],
+            )
+            try:
+                os.rmdir(d)
+            except OSError:
+                pass
+
+
+def _remove_entry(args):
+    """Remove path args[0], which is a directory if args[1]"""
+    if args[1]:
+        shutil.rmtree(args[0], ignore_errors=True)
+        return
+    try:
+        os.remove(args[0])
+    except OSError:
+        pass
+
+
+def _rename_to_remove(path):
+    """Move path into a hidden directory so it can be removed in the background
+
+    Returns:
+        str: directory to remove or None if path doesn't exist
+    """
+    try:
+        d = tempfile.mkdtemp(
+            dir=os.path.dirname(os.path.abspath(path)),
+            prefix=_REMOVE_PREFIX,
+        )
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return None
+        # Parent isn't writable so remove where it is
+        return path
+    try:
+        os.rename(path, os.path.join(d, 'x'))
+        return d
+    except OSError as e:
+        os.rmdir(d)
+        if e.errno == errno.ENOENT:
+            return None
+        # Remove where it is
+        return path
+
+
+def _resolve(path, existing_dirs=None):
+    """Implements `py_path` with strs
+
+    Only calls expanduser if there's a "~". With pkunit_prefix, the
+    parent directory is created unless it is in existing_dirs. Only
+    loops within a single call pass existing_dirs, because directories
+    may be removed between calls.
+
+    Args:
+        path (object): str, py.path, or None (current directory)
+        existing_dirs (set): parents known to exist, updated [None]
+
+    Returns:
+        str: absolute path
+    """
+    if path is None:
+        res = os.getcwd()
+    else:
+        res = path if isinstance(path, six.string_types) else str(path)
+        if '~' in res:
+            res = os.path.expanduser(res)
+        res = os.path.abspath(res)
+    if pkunit_prefix:
+        # Allow for <test>_work and <test>_data so we don't add
+        # prefix if there's a common parent directory.
+        if not res.startswith(pkunit_prefix.dirname):
+            res = pkunit_prefix.join(res).strpath
+        d = os.path.dirname(res)
+        if existing_dirs is None or d not in existing_dirs:
+            py.path.local(d).ensure(dir=True)
+            if existing_dirs is not None:
+                existing_dirs.add(d)
+    return res
+
+
+def _scan_dir(d, stat):
+    """List d[0] for `scan_tree`
+
+    Returns:
+        tuple: (d, list of (name, is_dir, is_symlink, lstat or None))
+    """
+    res = []
+    for e in _scandir(d[0]):
+        s = None
+        if stat and not e[1]:
+            try:
+                s = os.lstat(os.path.join(d[0], e[0]))
+            except OSError:
+                # removed while scanning
+                continue
+        res.append(e + (s,))
+    return d, res
+
+
+def _scandir(dirname):
+    """List dirname sorted by name, ignoring errors like `os.walk`
+
+    Returns:
+        list: (name, is_dir, is_symlink)
+    """
+    try:
+        if hasattr(os, 'scandir'):
+            res = [
+                (e.name, e.is_dir(), e.is_symlink())
+                for e in os.scandir(dirname)
+            ]
+        else:
+            res = []
+            for n in os.listdir(dirname):
+                p = os.path.join(dirname, n)
+                res.append((n, os.path.isdir(p), os.path.islink(p)))
+    except OSError:
+        return []
+    return sorted(res)
+
+
+def _stat_target(path, stat):
+    """Follow symlink, if stat (from lstat) is one
+
+    Returns:
+        os.stat_result: of the target or None if symlink is dangling
+    """
+    if not stat_module.S_ISLNK(stat.st_mode):
+        return stat
+    try:
+        return os.stat(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return None
+
+
+def _umask():
+    """Current process umask (only way to read it is to set it)"""
+    res = os.umask(0o22)
+    os.umask(res)
+    return res
+
+
+#: Read once, because setting the umask to read it races with other threads
+_UMASK = _umask()
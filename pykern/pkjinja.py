@@ -1,6 +1,21 @@
 # -*- coding: utf-8 -*-
 u"""Simplify rendering jinja2
 
+Environments and compiled templates are cached for the life of the
+process. A template is recompiled only if its file's modification
+time or size changes.
+
+If `cfg.bytecode_cache_dir` is set, compiled templates are also stored
+there (keyed by jinja2 version and validated by source checksum) so new processes
+don't recompile. ``pykern pkjinja precompile`` fills the cache for all
+templates in a package.
+
+`render_many` renders one template into many outputs on a thread
+or process pool.
+
+With ``stream=True``, `render_file` writes output as it is generated
+so large outputs are never held in memory.
+
 :copyright: Copyright (c) 2015 Bivio Software, Inc.  All Rights Reserved.
 :license: http://www.apache.org/licenses/LICENSE-2.0.html
 """
@@ -8,13 +23,50 @@ from __future__ import absolute_import, division, print_function
 from pykern.pkdebug import pkdc, pkdp
 
 import jinja2
+import locale
+import os
 
+from pykern import pkconfig
 from pykern import pkinspect
 from pykern import pkio
 from pykern import pkresource
 
+#: Size of write buffer used by `render_file` with stream
+STREAM_BUFFER_SIZE = 1 << 20
+
+#: `jinja2.FileSystemBytecodeCache` if `cfg.bytecode_cache_dir`
+_bytecode_cache = None
+
+#: Environments keyed by strict_undefined
+_envs = {}
+
+#: Compiled templates: (path, strict_undefined) to ((mtime, size), jinja2.Template)
+_templates = {}
+
+
+def compile_file(filename, strict_undefined=False):
+    """Compile filename, using the in-process and bytecode caches
+
+    Args:
+        filename (str or py.path): template file
+        strict_undefined (bool): set `jinja2.StrictUndefined` if True
+
+    Returns:
+        jinja2.Template: compiled template
+    """
+    fn = pkio.py_path(filename)
+    s = os.stat(str(fn))
+    m = (getattr(s, 'st_mtime_ns', s.st_mtime), s.st_size)
+    k = (str(fn), bool(strict_undefined))
+    res = _templates.get(k)
+    if res and res[0] == m:
+        return res[1]
+    t = _compile(_env(k[1]), k[0], pkio.read_text(fn))
+    _templates[k] = (m, t)
+    return t
 
-def render_file(filename, j2_ctx, output=None, strict_undefined=False):
+
+def render_file(filename, j2_ctx, output=None, strict_undefined=False, stream=False):
     """Render filename as template with j2_ctx.
 
     Args:
@@ -22,25 +74,60 @@ def render_file(filename, j2_ctx, output=None, strict_undefined=False):
         j2_ctx (dict): how to replace values in Jinja2 template
         output (str): file name of output; if None, return str
         strict_undefined (bool): set `jinja2.StrictUndefined` if True
+        stream (bool): write to output incrementally (requires output) [False]
 
     Returns:
-        str: rendered template
+        object: rendered template (str) or bytes written (int) if stream
     """
-    t = pkio.read_text(filename)
-    kw = dict(
-        trim_blocks=True,
-        lstrip_blocks=True,
-        keep_trailing_newline=True,
-    )
-    if strict_undefined:
-        kw['undefined'] = jinja2.StrictUndefined
-    je = jinja2.Environment(**kw)
-    res = je.from_string(t).render(j2_ctx)
+    t = compile_file(filename, strict_undefined)
+    if stream:
+        assert output, 'stream requires output'
+        return _stream(t, j2_ctx, output)
+    res = t.render(j2_ctx)
     if output:
         pkio.write_text(output, res)
     return res
 
 
+def render_many(filename, jobs, strict_undefined=False, stream=False, workers=None, processes=False):
+    """Render filename with many contexts in parallel
+
+    The template is compiled once (per process). Failures don't stop
+    other jobs; they are returned.
+
+    Args:
+        filename (str or py.path): template file; None if each job has its own
+        jobs (iterable): (j2_ctx, output) or (j2_ctx, output, filename)
+        strict_undefined (bool): set `jinja2.StrictUndefined` if True
+        stream (bool): see `render_file` [False]
+        workers (int): size of pool [cfg.render_many_workers or number of cpus]
+        processes (bool): use processes instead of threads [False]
+
+    Returns:
+        list: (output, exception) for jobs that failed
+    """
+    a = []
+    for j in jobs:
+        a.append((
+            str(j[2] if len(j) > 2 else filename),
+            j[0],
+            j[1],
+            strict_undefined,
+            stream,
+        ))
+    if not processes:
+        # Compile in this thread so workers share the cached templates
+        for f in set(x[0] for x in a):
+            try:
+                compile_file(f, strict_undefined)
+            except Exception:
+                # reported by _render_job
+                pass
+    with pkio._pool(workers or cfg.render_many_workers or None, processes) as p:
+        res = p.map(_render_job, a)
+    return [(x[2], e) for x, e in zip(a, res) if e]
+
+
 def render_resource(basename, *args, **kwargs):
     """Render a pkresource as a jinja template.
 
@@ -53,3 +140,80 @@ def render_resource(basename, *args, **kwargs):
         *args,
         **kwargs
     )
+
+
+def _compile(env, filename, source):
+    """Compile source or load from bytecode cache"""
+    global _bytecode_cache
+
+    if not cfg.bytecode_cache_dir:
+        return env.from_string(source)
+    if not _bytecode_cache:
+        _bytecode_cache = jinja2.FileSystemBytecodeCache(
+            str(pkio.mkdir_parent(cfg.bytecode_cache_dir)),
+            # bc_magic only has the bytecode format and Python versions
+            pattern='__pkjinja_{}_%s.cache'.format(jinja2.__version__),
+        )
+    # Bucket is keyed by jinja2 version and filename, and validated by
+    # a checksum of the source
+    b = _bytecode_cache.get_bucket(env, filename, filename, source)
+    if b.code is None:
+        b.code = env.compile(source, filename, filename)
+        _bytecode_cache.set_bucket(b)
+    return env.template_class.from_code(env, b.code, env.make_globals(None), None)
+
+
+def _render_job(args):
+    """Call `render_file` for `render_many`
+
+    Returns:
+        Exception: error or None
+    """
+    try:
+        render_file(
+            args[0],
+            args[1],
+            output=args[2],
+            strict_undefined=args[3],
+            stream=args[4],
+        )
+        return None
+    except Exception as e:
+        return e
+
+
+def _stream(template, j2_ctx, output):
+    """Write template's chunks to output as they are generated
+
+    output is only replaced if the whole template renders.
+    """
+    e = locale.getpreferredencoding()
+    res = 0
+    with pkio.atomic_open(output, 'wb', buffering=STREAM_BUFFER_SIZE) as f:
+        for c in template.generate(j2_ctx):
+            b = c.encode(e)
+            f.write(b)
+            res += len(b)
+    return res
+
+
+def _env(strict_undefined):
+    """Environment for options, created once"""
+    res = _envs.get(strict_undefined)
+    if res:
+        return res
+    kw = dict(
+        trim_blocks=True,
+        lstrip_blocks=True,
+        keep_trailing_newline=True,
+    )
+    if strict_undefined:
+        kw['undefined'] = jinja2.StrictUndefined
+    res = _envs[strict_undefined] = jinja2.Environment(**kw)
+    return res
+
+
+cfg = pkconfig.init(
+    bytecode_cache_dir=(None, str, 'where to store compiled templates for use by other processes'),
+    render_many_workers=(None, int, 'default size of render_many pool (None: number of cpus)'),
+)
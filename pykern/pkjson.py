@@ -1,45 +1,670 @@
 # -*- coding: utf-8 -*-
 u"""JSON help
 
+By default, the standard library :mod:`json` is used with
+``object_pairs_hook``. ``set_backend('orjson')`` selects orjson
+to decode documents, and the resulting `dict` tree is converted
+to `pkcollections.Dict` in bulk. orjson is only allowed if it
+rejects integers over 64 bits; some versions silently convert
+them to floats.
+
 :copyright: Copyright (c) 2017 RadiaSoft LLC.  All Rights Reserved.
 :license: http://www.apache.org/licenses/LICENSE-2.0.html
 """
 from __future__ import absolute_import, division, print_function
+# Avoid pykern imports at module level so pkcollections can import us
+import json
+import re
+
+#: Types walked by `canonical_hash`; others are scalars
+_CONTAINERS = (dict, list, tuple)
+
+#: Characters `iter_events` and `iter_select` read at a time
+CHUNK_SIZE = 64 * 1024
+
+#: Characters in keys escaped with a backslash in paths
+_PATH_ESCAPE_RE = re.compile(r'[\\.\[\]]')
+
+#: Bytes `LinesWriter` buffers before writing to the file
+LINES_BUFFER_SIZE = 1024 * 1024
+
+#: Backend names accepted by `set_backend`
+BACKENDS = ('orjson', 'json')
+
+#: Name of the backend currently in use (see `set_backend`)
+backend = None
+
+#: Integers an accelerated backend must reject or decode exactly
+_INT_OVER_64_BITS = (str(2 ** 64), str(-2 ** 63 - 1))
 
+#: Decoder for the selected backend, returns plain dicts and lists (or None for stdlib)
+_fast_loads = None
 
-def dump_pretty(obj, filename=None, pretty=True):
+#: Exceptions raised by `_fast_loads` which cause a retry with stdlib
+_fast_errors = ()
+
+
+def canonical_hash(obj, algorithm='sha256'):
+    """Hash a JSON-compatible tree without serializing it first
+
+    The encoding is canonical: keys are sorted, separators are compact,
+    and strings are ASCII-escaped, so equal trees hash the same regardless
+    of key order or `Dict` vs `dict`. Objects (dicts) which contain other
+    objects or nested lists are hashed on their own and their digests are
+    fed to their parent, which allows digests of `pkcollections.FrozenDict`
+    sub-trees to be memoized on the sub-tree itself, if the sub-tree
+    only contains `FrozenDict`, tuples, and scalars (e.g. from
+    `pkcollections.freeze`). All other values are
+    encoded inline by the stdlib encoder. Lists and tuples are equivalent.
+
+    Args:
+        obj (object): dict, list, tuple, str, int, float, bool, or None
+        algorithm (str): passed to :func:`hashlib.new` ["sha256"]
+
+    Returns:
+        str: hex digest
+    """
+    return _CanonicalHash(algorithm).hexdigest(obj)
+
+
+def dump_pretty(obj, filename=None, pretty=True, atomic=False, fsync=False):
     """Formats as json as string
 
+    Always uses the stdlib encoder so output (indentation, NaN handling,
+    and key sorting) is the same regardless of `backend`.
+
     Args:
         obj (object): any Pyton object
         filename (str or py.path): where to write [None]
         pretty (bool): pretty print [True]
+        atomic (bool): replace `filename` atomically (see `pkio.write_text`) [False]
+        fsync (bool): flush `filename` to disk before returning [False]
 
     Returns:
         str: sorted and formatted JSON
     """
     from pykern import pkio
-    import json
-    import py.path
 
     if pretty:
         res = json.dumps(obj, indent=4, separators=(',', ': '), sort_keys=True) + '\n'
     else:
         res = json.dumps(obj)
     if filename:
-        pkio.py_path(filename).write(res)
+        pkio.write_text(filename, res, atomic=atomic, fsync=fsync)
     return res
 
 
-def load_any(obj):
-    """Calls `pkcollections.json_load_any`
+def iter_events(filename_or_file, chunk_size=CHUNK_SIZE):
+    """Parse a JSON document incrementally, yielding leaf values
+
+    The document is read `chunk_size` characters at a time so only
+    the current value and path are in memory. Paths are dotted keys
+    with bracketed list indexes, e.g. ``models.beamline[3].name``.
+    Backslash, ``.``, ``[``, and ``]`` in keys are escaped with a
+    backslash, and empty keys are empty components, e.g. ``.b`` for
+    ``{"": {"b": 1}}``.
+    Empty objects and lists are yielded as values so the structure
+    can be reconstructed.
+
+    Args:
+        filename_or_file (object): file name, py.path, or object with "read"
+        chunk_size (int): how much to read at a time [`CHUNK_SIZE`]
+
+    Yields:
+        tuple: (path, value) where value is a scalar, empty Dict, or empty list
+    """
+    return _Parser(filename_or_file, chunk_size).iter(None)
+
+
+def iter_select(filename_or_file, pattern, chunk_size=CHUNK_SIZE):
+    """Parse a JSON document incrementally, materializing matching sub-trees
+
+    `pattern` is a path as in `iter_events` where ``[*]`` matches any
+    list index and a ``*`` component matches any non-empty key, e.g.
+    ``models.beamline[*]``. Keys in pattern are escaped as in the paths.
+    Only matching values are built (as with `load_any`); the rest of the
+    document is scanned and discarded. Values nested in a match are not
+    matched separately.
+
+    Args:
+        filename_or_file (object): file name, py.path, or object with "read"
+        pattern (str): which values to select
+        chunk_size (int): how much to read at a time [`CHUNK_SIZE`]
+
+    Yields:
+        tuple: (path, value) for each match in document order
+    """
+    r = re.escape(pattern).replace(r'\[\*\]', r'\[\d+\]').replace(r'\*', r'(?:[^.\[\\]|\\.)+')
+    return _Parser(filename_or_file, chunk_size).iter(re.compile(r + '$').match)
+
+
+def iter_lines(filename):
+    """Iterate records of a JSON Lines file one at a time
+
+    Files ending in ``.gz`` or ``.xz`` are decompressed on the fly.
+    Blank lines are skipped.
+
+    Args:
+        filename (str or py.path): file to read
+
+    Yields:
+        object: each record parsed by `load_any`
+    """
+    with _open_lines(filename, 'rb') as f:
+        for l in f:
+            if l.strip():
+                yield load_any(l.decode('utf-8'))
+
+
+def load_any(obj, *args, **kwargs):
+    """Read json file or str with ``object_pairs_hook=Dict``
+
+    If no `args` or `kwargs` are passed and an accelerated `backend`
+    is available, the document is decoded by the backend and converted
+    to `pkcollections.Dict` in bulk. If the backend rejects the
+    document (e.g. ``NaN`` or integers over 64 bits), it is reparsed
+    with the stdlib so semantics (and error messages) are unchanged.
 
     Args:
         obj (object): str or object with "read"
+        args (tuple): passed verbatim to :func:`json.loads`
+        kwargs (dict): passed to :func:`json.loads`; object_pairs_hook defaults to `pkcollections.object_pairs_hook`
 
     Returns:
         object: parsed JSON
     """
     from pykern import pkcollections
 
-    return pkcollections.json_load_any(obj)
+    o = obj.read() if hasattr(obj, 'read') else obj
+    if _fast_loads and not (args or kwargs):
+        try:
+            return _to_dict(_fast_loads(o))
+        except _fast_errors:
+            pass
+    kwargs.setdefault('object_pairs_hook', pkcollections.object_pairs_hook)
+    return json.loads(o, *args, **kwargs)
+
+
+class _CanonicalHash(object):
+    """Walk a tree with an explicit stack feeding one hash per non-leaf dict"""
+
+    #: Number of buffered tokens before updating the hash
+    _BUF_LEN = 4096
+
+    #: Attribute on `pkcollections.FrozenDict` holding memoized digests
+    _MEMO_ATTR = '_pkjson_canonical_hash'
+
+    def __init__(self, algorithm):
+        self._algorithm = algorithm
+
+    def hexdigest(self, obj):
+        from pykern import pkcollections
+        import math
+        import six
+
+        enc = json.encoder.encode_basestring_ascii
+        # each frame is [hash, token buffer, FrozenDict or None, is deep-frozen]
+        frames = [self._frame(None)]
+        # (True, token) or (False, value) or (None, None) for end of dict
+        stack = [(False, obj)]
+        while stack:
+            is_token, v = stack.pop()
+            f = frames[-1]
+            if is_token:
+                f[1].append(v)
+            elif is_token is None:
+                frames.pop()
+                d = self._memo(f, '#' + self._flush(f).hexdigest())
+                f = frames[-1]
+                f[1].append(d)
+            elif isinstance(v, dict):
+                if not isinstance(v, pkcollections.FrozenDict):
+                    self._mutable(frames)
+                if _is_leaf(v.values(), dict):
+                    if any(isinstance(x, list) for x in v.values()):
+                        self._mutable(frames)
+                    # the stdlib encodes scalars exactly as below
+                    if not all(isinstance(x, six.string_types) for x in v):
+                        raise TypeError('{!r}: object keys must be str'.format(v))
+                    f[1].append(_canonical_dumps(v, sort_keys=True))
+                    continue
+                z = v if isinstance(v, pkcollections.FrozenDict) else None
+                if z is not None:
+                    d = z.__dict__.get(self._MEMO_ATTR, {}).get(self._algorithm)
+                    if d:
+                        f[1].append(d)
+                        continue
+                frames.append(self._frame(z))
+                stack.append((None, None))
+                stack.append((True, '}'))
+                k = sorted(v)
+                for i in range(len(k) - 1, -1, -1):
+                    x = k[i]
+                    if not isinstance(x, six.string_types):
+                        raise TypeError('{!r}: object keys must be str'.format(x))
+                    stack.append((False, v[x]))
+                    stack.append((True, (',' if i else '') + enc(x) + ':'))
+                stack.append((True, '{'))
+            elif isinstance(v, _CONTAINERS[1:]):
+                if not isinstance(v, tuple):
+                    self._mutable(frames)
+                if _is_leaf(v, _CONTAINERS):
+                    f[1].append(_canonical_dumps(v))
+                    continue
+                stack.append((True, ']'))
+                for i in range(len(v) - 1, -1, -1):
+                    stack.append((False, v[i]))
+                    if i:
+                        stack.append((True, ','))
+                stack.append((True, '['))
+            elif isinstance(v, six.string_types):
+                f[1].append(enc(v))
+            elif v is None:
+                f[1].append('null')
+            elif v is True or v is False:
+                f[1].append('true' if v else 'false')
+            elif isinstance(v, float):
+                # same as the stdlib encoder
+                f[1].append(repr(v) if math.isinf(v) == math.isnan(v) else json.dumps(v))
+            elif isinstance(v, six.integer_types):
+                f[1].append(str(int(v)))
+            else:
+                raise TypeError('{!r}: is not JSON serializable'.format(v))
+            if len(f[1]) > self._BUF_LEN:
+                self._flush(f)
+        return self._flush(frames[0]).hexdigest()
+
+    def _flush(self, frame):
+        frame[0].update(''.join(frame[1]).encode('ascii'))
+        del frame[1][:]
+        return frame[0]
+
+    def _frame(self, frozen):
+        import hashlib
+
+        return [hashlib.new(self._algorithm), [], frozen, True]
+
+    def _memo(self, frame, digest):
+        """Memoize digest only if the FrozenDict's sub-tree can't change"""
+        if frame[2] is not None and frame[3]:
+            frame[2].__dict__.setdefault(self._MEMO_ATTR, {})[self._algorithm] = digest
+        return digest
+
+    def _mutable(self, frames):
+        """A mutable container was found so no enclosing frame is deep-frozen
+
+        Ancestors of a frame which isn't deep-frozen are already marked.
+        """
+        for f in reversed(frames):
+            if not f[3]:
+                break
+            f[3] = False
+
+
+class LinesWriter(object):
+    """Append records to a JSON Lines file
+
+    Records are serialized on one line each and buffered in memory until
+    `buffer_size` bytes accumulate or `flush` is called. Files ending
+    in ``.gz`` or ``.xz`` are compressed (appends add a new stream,
+    which readers handle transparently).
+
+    Use as a context manager so the buffer is written on exit::
+
+        with pkjson.LinesWriter('history.jsonl.gz') as w:
+            for r in records:
+                w.write(r)
+
+    Args:
+        filename (str or py.path): file to append to
+        buffer_size (int): bytes to buffer before writing [`LINES_BUFFER_SIZE`]
+    """
+    def __init__(self, filename, buffer_size=LINES_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self._buf = []
+        self._buf_len = 0
+        self._file = _open_lines(filename, 'ab')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Flush and close the file"""
+        if self._file:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+    def flush(self):
+        """Write buffered records and flush the file"""
+        if self._buf:
+            self._file.write(b''.join(self._buf))
+            self._buf = []
+            self._buf_len = 0
+        self._file.flush()
+
+    def write(self, obj):
+        """Serialize `obj` as one line
+
+        Args:
+            obj (object): any JSON-serializable object
+        """
+        l = (json.dumps(obj) + '\n').encode('utf-8')
+        self._buf.append(l)
+        self._buf_len += len(l)
+        if self._buf_len >= self.buffer_size:
+            self.flush()
+
+
+def set_backend(name=None):
+    """Select the JSON decoder
+
+    orjson is opt-in, because it must be checked for exact integers.
+
+    Args:
+        name (str): one of `BACKENDS` or None for json
+
+    Returns:
+        str: name of the backend selected
+    """
+    global backend, _fast_loads, _fast_errors
+
+    b = name or 'json'
+    if b == 'json':
+        _fast_loads = None
+        _fast_errors = ()
+    elif b == 'orjson':
+        import orjson
+
+        for x in _INT_OVER_64_BITS:
+            try:
+                if not isinstance(orjson.loads(x), int):
+                    raise ValueError(
+                        'orjson {}: converts integers over 64 bits to floats'.format(
+                            getattr(orjson, '__version__', '?'),
+                        ),
+                    )
+            except orjson.JSONDecodeError:
+                pass
+        _fast_loads = orjson.loads
+        _fast_errors = (orjson.JSONDecodeError,)
+    else:
+        raise ValueError('{}: unknown backend, valid: {}'.format(b, BACKENDS))
+    backend = b
+    return backend
+
+
+class _Parser(object):
+    """Tokenize and walk a JSON document read in chunks"""
+
+    _CLOSE = {True: '}', False: ']'}
+
+    _DELIMITER_RE = re.compile(r'[\s,:\[\]{}"]')
+
+    _LITERALS = {
+        'true': True,
+        'false': False,
+        'null': None,
+        'NaN': float('nan'),
+        'Infinity': float('inf'),
+        '-Infinity': float('-inf'),
+    }
+
+    _SCALAR_RE = re.compile(
+        r'-?(?:0|[1-9]\d*)(\.\d+)?([eE][-+]?\d+)?|true|false|null|NaN|-?Infinity',
+    )
+
+    _WS_RE = re.compile(r'[ \t\n\r]*')
+
+    def __init__(self, filename_or_file, chunk_size):
+        import codecs
+
+        self._chunk_size = chunk_size
+        self._file = filename_or_file
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buf = ''
+        self._eof = False
+        # chars discarded from the front of _buf
+        self._offset = 0
+        self._pos = 0
+        self._start = 0
+        self.value = None
+
+    def iter(self, match):
+        f = self._file
+        # py.path has "read", but it reads the whole file
+        if hasattr(f, 'read') and not hasattr(f, 'open'):
+            for x in self._iter(match):
+                yield x
+            return
+        from pykern import pkio
+
+        with open(str(pkio.py_path(f)), 'rb') as self._file:
+            for x in self._iter(match):
+                yield x
+
+    def _error(self, msg):
+        raise ValueError('{}: char {}'.format(msg, self._offset + self._start))
+
+    def _iter(self, match):
+        from pykern import pkcollections
+
+        path = []
+        # True for object, False for list
+        stack = []
+        t = self._token()
+        while True:
+            # t is the first token of a value at path
+            if match and match(_path_str(path)):
+                yield _path_str(path), self._materialize()
+            elif t == '{' or t == '[':
+                m = t == '{'
+                t = self._token()
+                if t == self._CLOSE[m]:
+                    if not match:
+                        yield _path_str(path), pkcollections.Dict() if m else []
+                else:
+                    stack.append(m)
+                    if m:
+                        path.append(self._key(t))
+                        t = self._token()
+                    else:
+                        path.append(0)
+                    continue
+            elif t == 's' or t == 'v':
+                if not match:
+                    yield _path_str(path), self.value
+            else:
+                self._error('expecting value')
+            while True:
+                if not stack:
+                    if self._token() is not None:
+                        self._error('extra data')
+                    return
+                t = self._token()
+                if t == ',':
+                    if stack[-1]:
+                        path[-1] = self._key(self._token())
+                    else:
+                        path[-1] += 1
+                    t = self._token()
+                    break
+                if t != self._CLOSE[stack[-1]]:
+                    self._error('expecting "," or "{}"'.format(self._CLOSE[stack[-1]]))
+                stack.pop()
+                path.pop()
+
+    def _key(self, t):
+        if t != 's':
+            self._error('expecting property name')
+        k = self.value
+        if self._token() != ':':
+            self._error('expecting ":"')
+        return k
+
+    def _materialize(self):
+        """Decode value starting at current token with the stdlib"""
+        from pykern import pkcollections
+
+        d = json.JSONDecoder(object_pairs_hook=pkcollections.object_pairs_hook)
+        while True:
+            try:
+                v, e = d.raw_decode(self._buf, self._start)
+                # A number at the end of the buffer may be truncated
+                if e < len(self._buf) or not self._more():
+                    self._pos = e
+                    return v
+            except ValueError:
+                # Grow geometrically so large values aren't decoded O(n^2)
+                if not self._more(len(self._buf)):
+                    raise
+
+    def _more(self, size=0):
+        """Append a chunk to the buffer, discarding what was consumed
+
+        Returns:
+            bool: False if at end of file
+        """
+        if self._eof:
+            return False
+        while True:
+            c = self._file.read(max(size, self._chunk_size))
+            if not isinstance(c, bytes):
+                break
+            d = self._decoder.decode(c, not c)
+            # chunk may end in the middle of a multibyte character
+            if d or not c:
+                c = d
+                break
+        if not c:
+            self._eof = True
+            return False
+        self._buf = self._buf[self._start:] + c
+        self._offset += self._start
+        self._pos -= self._start
+        self._start = 0
+        return True
+
+    def _token(self):
+        """Read next token
+
+        Returns:
+            str: punctuation, "s" (string), "v" (other scalar), or None at EOF
+        """
+        while True:
+            self._pos = self._WS_RE.match(self._buf, self._pos).end()
+            self._start = self._pos
+            if self._pos < len(self._buf):
+                break
+            if not self._more():
+                return None
+        c = self._buf[self._pos]
+        if c in '{}[]:,':
+            self._pos += 1
+            return c
+        if c == '"':
+            while True:
+                try:
+                    self.value, self._pos = json.decoder.scanstring(
+                        self._buf,
+                        self._pos + 1,
+                    )
+                    return 's'
+                except ValueError:
+                    if not self._more():
+                        raise
+        # Literal or number may continue in next chunk
+        while not self._DELIMITER_RE.search(self._buf, self._pos):
+            if not self._more():
+                break
+        m = self._SCALAR_RE.match(self._buf, self._pos)
+        if not m:
+            self._error('expecting value')
+        self._pos = m.end()
+        v = m.group(0)
+        if v in self._LITERALS:
+            self.value = self._LITERALS[v]
+        elif m.group(1) or m.group(2):
+            self.value = float(v)
+        else:
+            self.value = int(v)
+        return 'v'
+
+
+def _canonical_dumps(obj, **kwargs):
+    """Compact stdlib encoding of dict or list containing only scalars"""
+    return json.dumps(obj, separators=(',', ':'), **kwargs)
+
+
+def _is_leaf(values, not_allowed):
+    """No dicts in values, and lists in values contain only scalars
+
+    Such containers can be encoded by the stdlib in one call.
+    """
+    for v in values:
+        if isinstance(v, not_allowed):
+            return False
+        if isinstance(v, _CONTAINERS) and any(isinstance(x, _CONTAINERS) for x in v):
+            return False
+    return True
+
+
+def _open_lines(filename, mode):
+    """Open (possibly compressed) JSON Lines file in binary mode"""
+    from pykern import pkio
+
+    fn = str(pkio.py_path(filename))
+    if fn.endswith('.gz'):
+        import gzip
+        return gzip.open(fn, mode)
+    if fn.endswith('.xz'):
+        import lzma
+        return lzma.open(fn, mode)
+    return open(fn, mode)
+
+
+def _path_str(path):
+    """Convert keys and indexes to dotted path string"""
+    res = ''
+    for i, p in enumerate(path):
+        if isinstance(p, int):
+            res += '[{}]'.format(p)
+        else:
+            res += ('.' if i else '') + _PATH_ESCAPE_RE.sub(r'\\\g<0>', p)
+    return res
+
+
+def _to_dict(obj):
+    """Convert all dicts in a freshly decoded tree to `pkcollections.Dict`
+
+    Iterative so deep documents don't hit the recursion limit. Lists
+    are modified in place, because the decoder created them.
+
+    Args:
+        obj (object): dict, list, or scalar
+
+    Returns:
+        object: `obj` with dicts replaced
+    """
+    from pykern.pkcollections import Dict
+
+    if type(obj) == dict:
+        obj = Dict(obj)
+    elif type(obj) != list:
+        return obj
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        for k, v in (o.items() if type(o) == Dict else enumerate(o)):
+            if type(v) == dict:
+                v = o[k] = Dict(v)
+                stack.append(v)
+            elif type(v) == list:
+                stack.append(v)
+    return obj
+
+
+set_backend()
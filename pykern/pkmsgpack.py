@@ -0,0 +1,469 @@
+# -*- coding: utf-8 -*-
+u"""Compact binary serialization (MessagePack)
+
+Same data model as `pykern.pkjson` (dicts are returned as
+`pkcollections.Dict`), plus numeric arrays. An :class:`array.array`
+(e.g. from `pykern.pkarray.new_double`) is stored as raw little-endian
+bytes in an extension type, so it is not expanded to text and reparsed.
+On decode, arrays are :class:`memoryview` objects cast to the array's
+typecode, which reference the input buffer without copying, and which
+can be passed to ``numpy.frombuffer`` or :class:`array.array`. Any
+memoryview whose format isn't "B" (bytes) is encoded the same way, so
+decoded values can be encoded again. Item sizes must be the same on all
+platforms, so "l" and "L" are written as "i" or "q" ("I" or "Q"), and
+"u" is rejected.
+
+The encoder and decoder are pure Python. If the ``msgpack`` package
+is installed, it is used instead. The output is the same.
+
+`dump_file` and `load_file` select this format or JSON by file extension
+so callers can switch formats by changing file names.
+
+:copyright: Copyright (c) 2018 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+from pykern import pkcollections
+import array
+import struct
+import sys
+
+#: MessagePack extension type for `array.array`: typecode byte followed by items
+ARRAY_EXT_TYPE = 1
+
+#: File extension (without dot) for this format
+FILE_EXT = 'msgpack'
+
+#: msgpack module if installed (set by `set_backend`)
+_msgpack = None
+
+_NEED_SWAP = sys.byteorder != 'little'
+
+#: Typecodes whose item sizes are the same on all supported platforms
+_PORTABLE_TYPECODES = 'bBhHiIqQfd'
+
+
+def dump_bytes(obj, filename=None):
+    """Serialize obj
+
+    Args:
+        obj (object): dict, list, tuple, str, bytes, int, float, bool, None, array.array, or memoryview
+        filename (str or py.path): where to write [None]
+
+    Returns:
+        bytes: encoded data
+    """
+    if _msgpack:
+        res = _msgpack.packb(
+            _typed_buffers(obj),
+            default=_ext_default,
+            use_bin_type=True,
+        )
+    else:
+        res = _Encoder().encode(obj)
+    if filename:
+        from pykern import pkio
+
+        pkio.py_path(filename).write_binary(res)
+    return res
+
+
+def dump_file(obj, filename, **kwargs):
+    """Write obj in the format selected by the extension of filename
+
+    Files ending in `FILE_EXT` are written with `dump_bytes`;
+    all others with `pykern.pkjson.dump_pretty`.
+
+    Args:
+        obj (object): what to serialize
+        filename (str or py.path): where to write
+        kwargs (dict): passed to `pykern.pkjson.dump_pretty`
+
+    Returns:
+        object: bytes or str written
+    """
+    from pykern import pkio
+
+    if pkio.has_file_extension(filename, FILE_EXT):
+        return dump_bytes(obj, filename=filename)
+    from pykern import pkjson
+
+    return pkjson.dump_pretty(obj, filename=filename, **kwargs)
+
+
+def load_any(obj, copy_arrays=False):
+    """Deserialize bytes or object with "read"
+
+    Args:
+        obj (object): bytes, bytearray, memoryview, or object with "read"
+        copy_arrays (bool): return `array.array` instead of memoryview [False]
+
+    Returns:
+        object: decoded value
+    """
+    if hasattr(obj, 'read'):
+        obj = obj.read()
+    if _msgpack:
+        return _msgpack.unpackb(
+            obj,
+            ext_hook=lambda code, data: _ext_hook(code, data, copy_arrays),
+            object_pairs_hook=pkcollections.Dict,
+            raw=False,
+            strict_map_key=False,
+        )
+    return _Decoder(obj, copy_arrays).decode()
+
+
+def load_file(filename, **kwargs):
+    """Read filename in the format selected by its extension
+
+    Args:
+        filename (str or py.path): file to read
+        kwargs (dict): passed to `load_any` for this format
+
+    Returns:
+        object: decoded value
+    """
+    from pykern import pkio
+
+    p = pkio.py_path(filename)
+    if pkio.has_file_extension(p, FILE_EXT):
+        return load_any(p.read_binary(), **kwargs)
+    from pykern import pkjson
+
+    return pkjson.load_any(p)
+
+
+def set_backend(name=None):
+    """Select the msgpack (C) or pure Python implementation
+
+    Args:
+        name (str): "msgpack", "python", or None for msgpack if installed
+
+    Returns:
+        str: backend selected
+    """
+    global _msgpack
+
+    if name == 'python':
+        _msgpack = None
+        return name
+    try:
+        import msgpack
+        _msgpack = msgpack
+        return 'msgpack'
+    except ImportError:
+        if name:
+            raise
+    _msgpack = None
+    return 'python'
+
+
+class _Decoder(object):
+
+    def __init__(self, data, copy_arrays):
+        self._copy_arrays = copy_arrays
+        self._data = memoryview(data)
+        self._pos = 0
+
+    def decode(self):
+        # frames are [container, items left, pending key or _NO_KEY]
+        stack = []
+        while True:
+            v, n = self._value()
+            if n:
+                stack.append([v, n, _NO_KEY])
+                continue
+            while stack:
+                f = stack[-1]
+                if isinstance(f[0], list):
+                    f[0].append(v)
+                elif f[2] is _NO_KEY:
+                    f[2] = v
+                    break
+                else:
+                    f[0][f[2]] = v
+                    f[2] = _NO_KEY
+                f[1] -= 1
+                if f[1]:
+                    break
+                v = stack.pop()[0]
+            else:
+                if self._pos != len(self._data):
+                    raise ValueError('extra data after char {}'.format(self._pos))
+                return v
+
+    def _ext(self, n):
+        code = struct.unpack_from('b', self._data, self._pos)[0]
+        self._pos += 1
+        return _ext_hook(code, self._read(n), self._copy_arrays)
+
+    def _read(self, n):
+        if self._pos + n > len(self._data):
+            raise ValueError('truncated data at char {}'.format(self._pos))
+        res = self._data[self._pos:self._pos + n]
+        self._pos += n
+        return res
+
+    def _unpack(self, fmt):
+        s = struct.calcsize(fmt)
+        return struct.unpack(fmt, self._read(s))[0]
+
+    def _value(self):
+        """Decode next value or container header
+
+        Returns:
+            tuple: (value, None) or (container, number of items)
+        """
+        b = self._unpack('B')
+        if b <= 0x7f:
+            return b, None
+        if b >= 0xe0:
+            return b - 0x100, None
+        if 0xa0 <= b <= 0xbf:
+            return self._str(b & 0x1f), None
+        if 0x90 <= b <= 0x9f:
+            return [], b & 0x0f
+        if 0x80 <= b <= 0x8f:
+            return pkcollections.Dict(), b & 0x0f
+        if b in _FIXED:
+            return _FIXED[b], None
+        if b in _NUMBERS:
+            return self._unpack(_NUMBERS[b]), None
+        if b in _STR:
+            return self._str(self._unpack(_STR[b])), None
+        if b in _BIN:
+            return bytes(self._read(self._unpack(_BIN[b]))), None
+        if b in _ARRAY:
+            return [], self._unpack(_ARRAY[b])
+        if b in _MAP:
+            return pkcollections.Dict(), self._unpack(_MAP[b])
+        if b in _FIXEXT:
+            return self._ext(_FIXEXT[b]), None
+        if b in _EXT:
+            return self._ext(self._unpack(_EXT[b])), None
+        raise ValueError('0x{:02x}: invalid type byte at char {}'.format(b, self._pos - 1))
+
+    def _str(self, n):
+        return bytes(self._read(n)).decode('utf-8')
+
+
+class _Encoder(object):
+
+    def __init__(self):
+        self._buf = []
+
+    def encode(self, obj):
+        import six
+
+        b = self._buf
+        stack = [obj]
+        while stack:
+            v = stack.pop()
+            if v is None:
+                b.append(b'\xc0')
+            elif v is True or v is False:
+                b.append(b'\xc3' if v else b'\xc2')
+            elif isinstance(v, six.integer_types):
+                self._int(v)
+            elif isinstance(v, float):
+                b.append(struct.pack('>Bd', 0xcb, v))
+            elif isinstance(v, six.text_type):
+                self._bytes(v.encode('utf-8'), 0xa0, 0x1f, (0xd9, 0xda, 0xdb))
+            elif isinstance(v, (bytes, bytearray)) or _is_bytes_view(v):
+                self._bytes(bytes(v), None, 0, (0xc4, 0xc5, 0xc6))
+            elif isinstance(v, dict):
+                self._header(len(v), 0x80, 0x0f, (None, 0xde, 0xdf))
+                for k, x in reversed(list(v.items())):
+                    stack.append(x)
+                    stack.append(k)
+            elif isinstance(v, (list, tuple)):
+                self._header(len(v), 0x90, 0x0f, (None, 0xdc, 0xdd))
+                stack.extend(reversed(v))
+            else:
+                e = _ext_default(v)
+                self._ext(e.code, e.data)
+        return b''.join(b)
+
+    def _bytes(self, value, fix, fix_max, codes):
+        self._header(len(value), fix, fix_max, codes)
+        self._buf.append(value)
+
+    def _ext(self, code, data):
+        n = len(data)
+        f = _FIXEXT_CODES.get(n)
+        if f:
+            self._buf.append(struct.pack('>Bb', f, code))
+        else:
+            self._header(n, None, 0, (0xc7, 0xc8, 0xc9))
+            self._buf.append(struct.pack('>b', code))
+        self._buf.append(data)
+
+    def _header(self, n, fix, fix_max, codes):
+        if fix is not None and n <= fix_max:
+            self._buf.append(struct.pack('>B', fix | n))
+        elif codes[0] and n <= 0xff:
+            self._buf.append(struct.pack('>BB', codes[0], n))
+        elif n <= 0xffff:
+            self._buf.append(struct.pack('>BH', codes[1], n))
+        elif n <= 0xffffffff:
+            self._buf.append(struct.pack('>BI', codes[2], n))
+        else:
+            raise ValueError('{}: too many items or bytes'.format(n))
+
+    def _int(self, v):
+        if 0 <= v <= 0x7f or -32 <= v < 0:
+            self._buf.append(struct.pack('>b' if v < 0 else '>B', v))
+            return
+        for c, f in _INT_CODES:
+            try:
+                self._buf.append(struct.pack(f, c, v))
+                return
+            except struct.error:
+                pass
+        raise OverflowError('{}: integer too large for 64 bits'.format(v))
+
+
+class _ExtType(object):
+    """Same attributes as `msgpack.ExtType`"""
+
+    def __init__(self, code, data):
+        self.code = code
+        self.data = data
+
+
+_NO_KEY = object()
+
+_FIXED = {0xc0: None, 0xc2: False, 0xc3: True}
+
+_NUMBERS = {
+    0xca: '>f',
+    0xcb: '>d',
+    0xcc: '>B',
+    0xcd: '>H',
+    0xce: '>I',
+    0xcf: '>Q',
+    0xd0: '>b',
+    0xd1: '>h',
+    0xd2: '>i',
+    0xd3: '>q',
+}
+
+_INT_CODES = tuple((c, '>B' + _NUMBERS[c][1:]) for c in (0xcc, 0xcd, 0xce, 0xcf, 0xd0, 0xd1, 0xd2, 0xd3))
+
+_STR = {0xd9: '>B', 0xda: '>H', 0xdb: '>I'}
+
+_BIN = {0xc4: '>B', 0xc5: '>H', 0xc6: '>I'}
+
+_ARRAY = {0xdc: '>H', 0xdd: '>I'}
+
+_MAP = {0xde: '>H', 0xdf: '>I'}
+
+_FIXEXT = {0xd4: 1, 0xd5: 2, 0xd6: 4, 0xd7: 8, 0xd8: 16}
+
+_FIXEXT_CODES = dict((v, k) for k, v in _FIXEXT.items())
+
+_EXT = {0xc7: '>B', 0xc8: '>H', 0xc9: '>I'}
+
+
+def _ext_default(obj):
+    """Encode `array.array` or typed memoryview as extension type"""
+    if isinstance(obj, memoryview):
+        obj = _view_array(obj)
+    if not isinstance(obj, array.array):
+        raise TypeError('{!r}: is not serializable'.format(obj))
+    obj = _portable_array(obj)
+    if _NEED_SWAP:
+        obj = array.array(obj.typecode, obj)
+        obj.byteswap()
+    d = obj.typecode.encode('ascii') + (
+        obj.tobytes() if hasattr(obj, 'tobytes') else obj.tostring()
+    )
+    if _msgpack:
+        return _msgpack.ExtType(ARRAY_EXT_TYPE, d)
+    return _ExtType(ARRAY_EXT_TYPE, d)
+
+
+def _is_bytes_view(obj):
+    return isinstance(obj, memoryview) and obj.format == 'B'
+
+
+def _portable_array(obj):
+    """Convert "l" and "L" to fixed size typecodes, and reject others"""
+    t = obj.typecode
+    if t in _PORTABLE_TYPECODES:
+        return obj
+    if t in 'lL':
+        x = 'q' if obj.itemsize == 8 else 'i'
+        return array.array(x if t == 'l' else x.upper(), obj)
+    raise TypeError(
+        '{!r}: typecode={} item size varies by platform'.format(obj, t),
+    )
+
+
+def _typed_buffers(obj):
+    """Convert typed memoryviews to `array.array` for msgpack
+
+    msgpack encodes all memoryviews as bin without calling default.
+    Containers are only copied if they contain a typed memoryview.
+    """
+    order = []
+    found = False
+    stack = [obj]
+    while stack:
+        v = stack.pop()
+        if isinstance(v, (dict, list, tuple)):
+            order.append(v)
+            stack.extend(v.values() if isinstance(v, dict) else v)
+        elif isinstance(v, memoryview) and not _is_bytes_view(v):
+            found = True
+    if not found:
+        return obj
+    res = {}
+
+    def _f(x):
+        if isinstance(x, memoryview) and not _is_bytes_view(x):
+            return _view_array(x)
+        return res.get(id(x), x)
+
+    # children are after parents in order
+    for v in reversed(order):
+        if isinstance(v, dict):
+            x = [(k, _f(y)) for k, y in v.items()]
+            if any(y is not z for (_, y), z in zip(x, v.values())):
+                res[id(v)] = dict(x)
+        else:
+            x = [_f(y) for y in v]
+            if any(y is not z for y, z in zip(x, v)):
+                res[id(v)] = x
+    return _f(obj)
+
+
+def _view_array(obj):
+    """Copy memoryview to `array.array` of the same type"""
+    t = obj.format.lstrip('@')
+    if len(t) != 1 or t not in array.typecodes:
+        raise TypeError('{!r}: format={} is not serializable'.format(obj, obj.format))
+    return array.array(t, obj.tobytes())
+
+
+def _ext_hook(code, data, copy_arrays):
+    """Decode `array.array` extension type"""
+    if code != ARRAY_EXT_TYPE:
+        raise ValueError('{}: unknown extension type'.format(code))
+    t = chr(bytearray(data[:1])[0])
+    v = memoryview(data)[1:]
+    if copy_arrays or _NEED_SWAP or not hasattr(v, 'cast'):
+        res = array.array(t)
+        b = v.tobytes()
+        if hasattr(res, 'frombytes'):
+            res.frombytes(b)
+        else:
+            res.fromstring(b)
+        if _NEED_SWAP:
+            res.byteswap()
+        return res
+    return v.cast(t)
+
+
+set_backend()
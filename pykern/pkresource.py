@@ -1,6 +1,17 @@
 # -*- coding: utf-8 -*-
 u"""Where external resources are stored
 
+Resources are found relative to the root package's directory.
+`pkg_resources` (which is slow to import) is only used for zipped
+installs. Lookups are cached.
+
+`pykern.pksetup` writes `MANIFEST_BASENAME` in package_data, which lists
+every resource with its size and hash. In installed packages, `read_tree`
+uses it to find resources without listing directories. The manifest is
+checked against the sizes of the files once per process. In source trees
+(e.g. editable installs), resources change after setup, so the manifest
+is ignored.
+
 :copyright: Copyright (c) 2015 Bivio Software, Inc.  All Rights Reserved.
 :license: http://www.apache.org/licenses/LICENSE-2.0.html
 """
@@ -8,13 +19,29 @@ from __future__ import absolute_import, division, print_function
 
 # Root module: Import only builtin packages so avoid dependency issues
 import errno
-import inspect
+import hashlib
+import importlib
+import io
+import json
 import os.path
-import pkg_resources
-import re
+import sys
 
 from pykern import pkinspect
-from pykern import pksetup
+
+#: Written by `write_manifest` in package_data
+MANIFEST_BASENAME = 'pkresource-manifest.json'
+
+#: Format of manifest
+MANIFEST_VERSION = 1
+
+#POSIT: same as pksetup.PACKAGE_DATA (pksetup imports setuptools, which is slow)
+_PACKAGE_DATA = 'package_data'
+
+#: (root package, relative_filename) to absolute path of resource
+_cache = {}
+
+#: root package to result of `manifest` (for the life of the process)
+_manifests = {}
 
 
 def filename(relative_filename, caller_context=None):
@@ -27,10 +54,171 @@ def filename(relative_filename, caller_context=None):
     Returns:
         str: absolute path of the resource file
     """
-    pkg = pkinspect.root_package(
-        caller_context if caller_context else pkinspect.caller_module())
-    fn = os.path.join(pksetup.PACKAGE_DATA, relative_filename)
-    res = pkg_resources.resource_filename(pkg, fn)
-    if not os.path.exists(res):
+    return _filename(_root_package(caller_context), relative_filename)
+
+
+def manifest(caller_context=None):
+    """All files in package_data with their sizes and hashes
+
+    Read from `MANIFEST_BASENAME` if it exists and matches package_data.
+    Otherwise (e.g. a source tree), package_data is walked and hashes are
+    None. The result is cached for the life of the process.
+
+    Args:
+        caller_context (object): Any object from which to get the `root_package`
+
+    Returns:
+        dict: relative filename to (size, sha256 hexdigest)
+    """
+    return _manifest(_root_package(caller_context))
+
+
+def mmap_file(relative_filename, caller_context=None):
+    """Map resource into memory read-only
+
+    The file is not read until the buffer is accessed. Call
+    ``close`` (or use ``with``) on the result when done.
+    See `pykern.pkio.mmap_file`.
+
+    Args:
+        relative_filename (str): file name relative to package_data directory.
+        caller_context (object): Any object from which to get the `root_package`
+
+    Returns:
+        mmap.mmap: read-only buffer
+    """
+    # pkio is not a root module
+    from pykern import pkio
+
+    return pkio.mmap_file(
+        _filename(_root_package(caller_context), relative_filename),
+    )
+
+
+def read_tree(relative_dirname='', caller_context=None):
+    """Read all resources in relative_dirname (recursively)
+
+    Args:
+        relative_dirname (str): directory relative to package_data ['']
+        caller_context (object): Any object from which to get the `root_package`
+
+    Returns:
+        dict: filename relative to relative_dirname to contents (bytes)
+    """
+    pkg = _root_package(caller_context)
+    p = relative_dirname.strip('/')
+    if p:
+        p += '/'
+    res = {}
+    for r, v in _manifest(pkg).items():
+        if r.startswith(p):
+            with io.open(_filename(pkg, r, check=False), 'rb') as f:
+                res[r[len(p):]] = f.read()
+    return res
+
+
+def write_manifest(dirname, files):
+    """Write `MANIFEST_BASENAME` in dirname, which is package_data
+
+    Called by `pykern.pksetup`.
+
+    Args:
+        dirname (str): package_data directory
+        files (list): paths (including dirname) to files to include
+
+    Returns:
+        str: path to manifest
+    """
+    res = os.path.join(dirname, MANIFEST_BASENAME)
+    m = {}
+    for f in files:
+        r = os.path.relpath(f, dirname).replace(os.sep, '/')
+        if r == MANIFEST_BASENAME:
+            continue
+        with io.open(f, 'rb') as x:
+            b = x.read()
+        m[r] = (len(b), hashlib.sha256(b).hexdigest())
+    with io.open(res, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(
+            {'version': MANIFEST_VERSION, 'files': m},
+            indent=0,
+            sort_keys=True,
+        ) + u'\n')
+    return res
+
+
+def _filename(pkg, relative_filename, check=True):
+    k = (pkg, relative_filename)
+    res = _cache.get(k)
+    if res:
+        return res
+    res = _package_filename(pkg, os.path.join(_PACKAGE_DATA, relative_filename))
+    if check and not os.path.exists(res):
         raise IOError((errno.ENOENT, 'resource does not exist', res))
+    _cache[k] = res
+    return res
+
+
+def _manifest(pkg):
+    """Read manifest or walk package_data (cached)"""
+    res = _manifests.get(pkg)
+    if res is not None:
+        return res
+    res = _read_manifest(_filename(pkg, MANIFEST_BASENAME, check=False))
+    if res is None:
+        res = {}
+        d = _filename(pkg, '')
+        for r, _, files in os.walk(d):
+            for f in files:
+                p = os.path.join(r, f)
+                x = os.path.relpath(p, d).replace(os.sep, '/')
+                if x != MANIFEST_BASENAME:
+                    res[x] = (os.path.getsize(p), None)
+    _manifests[pkg] = res
     return res
+
+
+def _read_manifest(path):
+    """Files in manifest or None if missing, in a source tree, or stale
+
+    The manifest is stale if a file it lists is missing or its size
+    differs. Directory mtimes can't be used, because installers write
+    the manifest in any order with the other files.
+    """
+    if not os.path.exists(path):
+        return None
+    d = os.path.dirname(path)
+    if os.path.exists(os.path.join(os.path.dirname(os.path.dirname(d)), 'setup.py')):
+        return None
+    with io.open(path, 'r', encoding='utf-8') as f:
+        m = json.load(f)
+    assert m['version'] == MANIFEST_VERSION, \
+        '{}: unknown manifest version'.format(m['version'])
+    res = {}
+    for k, v in m['files'].items():
+        try:
+            if os.path.getsize(os.path.join(d, k)) != v[0]:
+                return None
+        except OSError:
+            return None
+        res[str(k)] = (v[0], str(v[1]))
+    return res
+
+
+def _package_filename(pkg, fn):
+    """Join fn to directory of pkg or extract with pkg_resources if zipped"""
+    d = os.path.dirname(importlib.import_module(pkg).__file__)
+    if os.path.isdir(d):
+        return os.path.join(d, fn)
+    import pkg_resources
+
+    return pkg_resources.resource_filename(pkg, fn)
+
+
+def _root_package(caller_context):
+    """Root package of caller_context or the caller of our caller"""
+    if caller_context:
+        return pkinspect.root_package(caller_context)
+    # Faster than pkinspect.caller_module, and the same, because
+    # our caller's caller is not this module
+    return sys._getframe(2).f_globals['__name__'].split('.')[0]
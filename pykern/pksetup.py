@@ -633,6 +633,11 @@ include LICENSE
         f = _find_files(d)
         if f:
             if is_pd:
+                # Deferred import so initial setup.py works
+                from pykern import pkresource
+                m = pkresource.write_manifest(d, f)
+                if m not in f:
+                    f.append(m)
                 state[which] = {base['name']: f}
                 state['include_package_data'] = True
             else:
@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+u"""Watch a directory tree for created, modified, and deleted files
+
+Only files are reported, not directories.
+
+On Linux, inotify (via ctypes) delivers events as they happen.
+Elsewhere, or if inotify fails (e.g. too many watches), the tree is
+scanned every `Watcher.poll_interval` seconds with `pkio.scan_tree`.
+
+Events are debounced: after the first event, events are collected until
+none arrive for `Watcher.debounce` seconds (or for at most
+`Watcher.max_delay` seconds, if a file is written continuously), and
+events for the same path are combined (e.g. create followed by modify is a create, and create
+followed by delete is dropped).
+
+Example::
+
+    with pkwatch.Watcher('run') as w:
+        for e in w:
+            print(e.kind, e.path)
+
+:copyright: Copyright (c) 2018 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+from pykern import pkio
+from pykern.pkdebug import pkdc, pkdlog, pkdp
+import collections
+import errno
+import os
+import struct
+import sys
+import threading
+import time
+
+#: File was created (or moved into the tree)
+CREATE = 'create'
+
+#: File was deleted (or moved out of the tree)
+DELETE = 'delete'
+
+#: File was written
+MODIFY = 'modify'
+
+#: What `Watcher` returns
+Event = collections.namedtuple('Event', ('kind', 'path'))
+
+#: Combination of an earlier and later event for a path; None means drop both
+_MERGE = {
+    (CREATE, DELETE): None,
+    (CREATE, MODIFY): CREATE,
+    (DELETE, CREATE): MODIFY,
+    (DELETE, MODIFY): MODIFY,
+    (MODIFY, CREATE): MODIFY,
+}
+
+# See inotify(7)
+_IN_MODIFY = 0x2
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_Q_OVERFLOW = 0x4000
+_IN_IGNORED = 0x8000
+_IN_ONLYDIR = 0x1000000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+
+_IN_MASK = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO \
+    | _IN_CREATE | _IN_DELETE | _IN_ONLYDIR
+
+_IN_EVENT = struct.Struct('iIII')
+
+
+class Watcher(object):
+    """Watch dirname (recursively)
+
+    Only one thread may call `read` (or iterate) at a time.
+
+    Args:
+        dirname (str or py.path): directory to watch
+        debounce (float): seconds without events to end a batch [0.1]
+        poll_interval (float): seconds between scans if polling [1]
+        poll (bool): don't use inotify [False]
+        max_delay (float): seconds after the first event to end a batch [1]
+
+    Attributes:
+        backend (str): "inotify" or "poll"
+    """
+
+    def __init__(self, dirname, debounce=0.1, poll_interval=1, poll=False, max_delay=1):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self._dirname = str(pkio.py_path(dirname).realpath())
+        self._backend = None
+        if not poll and sys.platform.startswith('linux'):
+            try:
+                self._backend = _Inotify(self._dirname)
+            except (OSError, AttributeError) as e:
+                pkdlog('{}: inotify failed, polling: {}', self._dirname, e)
+        if not self._backend:
+            self._backend = _Poll(self._dirname, self)
+        self.backend = self._backend.name
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        while self._backend:
+            for e in self.read():
+                yield e
+
+    def asyncio_queue(self, loop=None):
+        """Put events on a `asyncio.Queue` from a thread
+
+        Use ``await q.get()`` in the loop. The thread exits after `close`.
+
+        Args:
+            loop (asyncio.AbstractEventLoop): where the queue is read [current loop]
+
+        Returns:
+            asyncio.Queue: events
+        """
+        import asyncio
+
+        l = loop or asyncio.get_event_loop()
+        if l.is_running():
+            # Called from a coroutine in l
+            res = asyncio.Queue()
+        else:
+            # Before Python 3.10, a Queue binds to the loop it is created in
+            f = l.create_future()
+            l.call_soon(lambda: f.set_result(asyncio.Queue()))
+            res = l.run_until_complete(f)
+
+        def _run():
+            while self._backend:
+                for e in self.read(timeout=self.poll_interval):
+                    l.call_soon_threadsafe(res.put_nowait, e)
+
+        t = threading.Thread(target=_run)
+        t.daemon = True
+        t.start()
+        return res
+
+    def close(self):
+        """Stop watching"""
+        b = self._backend
+        self._backend = None
+        if b:
+            b.close()
+
+    def read(self, timeout=None):
+        """Wait for a debounced batch of events
+
+        Args:
+            timeout (float): seconds to wait for the first event [forever]
+
+        Returns:
+            list: `Event` objects in order of first occurrence (empty on timeout or close)
+        """
+        end = None if timeout is None else time.time() + timeout
+        res = collections.OrderedDict()
+        while not res:
+            b = self._backend
+            if not b:
+                return []
+            t = None if end is None else end - time.time()
+            if t is not None and t <= 0:
+                return []
+            e = b.read(t)
+            if e is None:
+                # timed out
+                return []
+            self._merge(res, e)
+            m = time.time() + max(self.max_delay, self.debounce)
+            while True:
+                t = min(self.debounce, m - time.time())
+                if t <= 0:
+                    break
+                e = b.read(t)
+                if e is None:
+                    break
+                self._merge(res, e)
+        return [Event(k, p) for p, k in res.items()]
+
+    def run(self, callback):
+        """Call callback with each `Event` until `close`
+
+        Args:
+            callback (callable): passed an `Event`
+        """
+        for e in self:
+            callback(e)
+
+    def _merge(self, events, new):
+        for k, p in new:
+            if p not in events:
+                events[p] = k
+                continue
+            m = _MERGE.get((events[p], k), k)
+            if m is None:
+                del events[p]
+            else:
+                events[p] = m
+
+
+class _Inotify(object):
+
+    name = 'inotify'
+
+    def __init__(self, dirname):
+        import ctypes
+        import ctypes.util
+
+        self._libc = ctypes.CDLL(
+            ctypes.util.find_library('c') or 'libc.so.6',
+            use_errno=True,
+        )
+        self._fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            self._raise('inotify_init1')
+        self._wds = {}
+        self._files = set()
+        # close writes to the pipe to wake up a reader blocked in select
+        self._wake = os.pipe()
+        try:
+            self._add_tree(dirname, None)
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        if self._fd < 0:
+            return
+        fd = self._fd
+        self._fd = -1
+        os.write(self._wake[1], b'x')
+        for x in (fd,) + self._wake:
+            os.close(x)
+
+    def read(self, timeout):
+        """Read events
+
+        Returns:
+            list: (kind, path) or None if timeout
+        """
+        import select
+
+        if self._fd < 0:
+            return None
+        try:
+            r = select.select([self._fd, self._wake[0]], [], [], timeout)[0]
+        except (OSError, ValueError, select.error):
+            # closed by another thread
+            if self._fd < 0:
+                return None
+            raise
+        if self._fd < 0 or not r:
+            return None
+        try:
+            b = os.read(self._fd, 1 << 16)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EBADF):
+                return []
+            raise
+        res = []
+        i = 0
+        while i < len(b):
+            wd, m, _, n = _IN_EVENT.unpack_from(b, i)
+            i += _IN_EVENT.size
+            name = b[i:i + n].rstrip(b'\0')
+            i += n
+            if m & _IN_IGNORED:
+                self._wds.pop(wd, None)
+                continue
+            if m & _IN_Q_OVERFLOW:
+                pkdlog('inotify queue overflow, events lost')
+                continue
+            d = self._wds.get(wd)
+            if d is None:
+                continue
+            p = os.path.join(d, name.decode(sys.getfilesystemencoding()))
+            if m & _IN_ISDIR:
+                # Like _Poll, only report files
+                if m & (_IN_CREATE | _IN_MOVED_TO):
+                    self._add_tree(p, res)
+                elif m & (_IN_DELETE | _IN_MOVED_FROM):
+                    self._remove_tree(p, res)
+            elif m & (_IN_CREATE | _IN_MOVED_TO):
+                self._files.add(p)
+                res.append((CREATE, p))
+            elif m & (_IN_DELETE | _IN_MOVED_FROM):
+                self._files.discard(p)
+                res.append((DELETE, p))
+            else:
+                res.append((MODIFY, p))
+        return res
+
+    def _add_tree(self, dirname, events):
+        """Watch dirname and its subdirectories
+
+        Files found are added to events (if not None), because they may
+        have been created before the watch was added.
+        """
+        for r, dirs, files in os.walk(dirname):
+            wd = self._libc.inotify_add_watch(
+                self._fd,
+                r.encode(sys.getfilesystemencoding()),
+                _IN_MASK,
+            )
+            if wd < 0:
+                # Directory was removed before it could be watched
+                if events is not None:
+                    continue
+                self._raise(r)
+            self._wds[wd] = r
+            f = [os.path.join(r, x) for x in files]
+            self._files.update(f)
+            if events is not None:
+                events.extend((CREATE, x) for x in f)
+
+    def _remove_tree(self, dirname, events):
+        """Stop watching dirname (moved or deleted) and delete its files
+
+        A moved directory's watches would otherwise report events
+        under its old path.
+        """
+        p = dirname + os.sep
+        for wd, d in list(self._wds.items()):
+            if d == dirname or d.startswith(p):
+                # may fail if the directory is already gone
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._wds[wd]
+        f = sorted(x for x in self._files if x.startswith(p))
+        self._files.difference_update(f)
+        events.extend((DELETE, x) for x in f)
+
+    def _raise(self, what):
+        import ctypes
+
+        e = ctypes.get_errno()
+        raise OSError(e, '{}: {}'.format(what, os.strerror(e)))
+
+
+class _Poll(object):
+
+    name = 'poll'
+
+    def __init__(self, dirname, watcher):
+        self._dirname = dirname
+        self._watcher = watcher
+        self._closed = False
+        self._state = self._scan()
+
+    def close(self):
+        self._closed = True
+
+    def read(self, timeout):
+        """Scan every poll_interval until something changes
+
+        Returns:
+            list: (kind, path) or None if timeout
+        """
+        end = None if timeout is None else time.time() + timeout
+        while not self._closed:
+            t = self._watcher.poll_interval
+            if end is not None:
+                t = min(t, end - time.time())
+                if t <= 0:
+                    return None
+            time.sleep(t)
+            s = self._scan()
+            res = []
+            for p, v in s.items():
+                x = self._state.get(p)
+                if x is None:
+                    res.append((CREATE, p))
+                elif x != v:
+                    res.append((MODIFY, p))
+            res.extend((DELETE, p) for p in self._state if p not in s)
+            self._state = s
+            if res:
+                return sorted(res, key=lambda e: e[1])
+        return None
+
+    def _scan(self):
+        return dict(
+            (p, (getattr(s, 'st_mtime_ns', s.st_mtime), s.st_size, s.st_ino))
+            for p, s in pkio.scan_tree(self._dirname, stat=True)
+        )
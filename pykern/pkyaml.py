@@ -1,42 +1,130 @@
 # -*- coding: utf-8 -*-
 u"""Wrapper for :mod:`yaml`
 
+Documents are parsed with the libyaml (C) safe loader if available,
+else the pure Python safe loader. Arbitrary Python objects cannot
+be constructed from YAML.
+
+Parsed files can be cached (see `cfg`) for the life of the process
+and/or on disk as pickles, which are validated by the file's
+resolved path, modification time, and size.
+
 :copyright: Copyright (c) 2015 RadiaSoft LLC.  All Rights Reserved.
 :license: http://www.apache.org/licenses/LICENSE-2.0.html
 """
 from __future__ import absolute_import, division, print_function
 from pykern import pkcollections
 from pykern import pkcompat
+from pykern import pkconfig
 from pykern import pkinspect
 from pykern import pkio
 from pykern import pkresource
+import hashlib
+import io
+import locale
+import os
+import pickle
 import py
 import yaml
 
+#: Base class of `_Loader`; safe, and C-accelerated if libyaml is installed
+_BaseLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+#: Base class of `_Dumper`; C-accelerated if libyaml is installed
+_BaseDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+#: Parsed files: realpath to [key, pickled value, frozen value or None]
+_cache = {}
+
+
+def dump_iter(values, filename):
+    """Write each value as a separate ``---`` document
+
+    `values` is consumed one at a time so it may be a generator.
+
+    Args:
+        values (iterable): dicts, lists, or scalars
+        filename (str or py.path): file to write
+
+    Returns:
+        py.path.local: filename
+    """
+    fn = pkio.py_path(filename)
+    with io.open(str(fn), 'w', encoding=locale.getpreferredencoding()) as f:
+        yaml.dump_all(
+            values,
+            f,
+            Dumper=_Dumper,
+            allow_unicode=True,
+            default_flow_style=False,
+            explicit_start=True,
+        )
+    return fn
+
+
+def iter_file(filename):
+    """Read documents from a multi-document file one at a time
+
+    Args:
+        filename (str or py.path): file to read
+
+    Yields:
+        object: each document as in `load_str`
+    """
+    fn = pkio.py_path(filename)
+    with io.open(str(fn), encoding=locale.getpreferredencoding()) as f:
+        for v in yaml.load_all(f, Loader=_Loader):
+            yield v
+
+
+def iter_str(value):
+    """Parse documents in a multi-document string one at a time
+
+    Args:
+        value (str): string to parse
+
+    Yields:
+        object: each document as in `load_str`
+    """
+    for v in yaml.load_all(value, Loader=_Loader):
+        yield v
+
 
-def load_file(filename):
+def load_file(filename, frozen=False):
     """Read a file, making sure all keys and values are locale.
 
+    If caching is enabled (`cfg.cache` or `cfg.cache_dir`), the file is
+    only parsed if its resolved path, mtime, or size changed. Each call
+    gets a private (mutable) copy of the cached value, unless `frozen`,
+    in which case all callers share one deep-frozen value.
+
     Args:
         filename (str): file to read (Note: ``.yml`` will not be appended)
+        frozen (bool): return `pkcollections.FrozenDict` and tuples [False]
 
     Returns:
         object: `pkcollections.Dict` or list
     """
-    return load_str(pkio.read_text(filename))
+    if cfg.cache or cfg.cache_dir:
+        return _cached(filename, frozen)
+    res = load_str(pkio.read_text(filename))
+    return pkcollections.freeze(res) if frozen else res
 
 
-def load_resource(basename):
+def load_resource(basename, frozen=False):
     """Read a resource, making sure all keys and values are locale
 
     Args:
         basename (str): file to read without yml suffix
+        frozen (bool): see `load_file`
 
     Returns:
         object: `pkcollections.Dict` or list
     """
     return load_file(
-        pkresource.filename(basename + '.yml', pkinspect.caller_module()))
+        pkresource.filename(basename + '.yml', pkinspect.caller_module()),
+        frozen=frozen,
+    )
 
 
 def load_str(value):
@@ -48,21 +136,103 @@ def load_str(value):
     Returns:
         object: `pkcollections.Dict` or list
     """
-    return _fixup(yaml.load(value))
-
-
-def _fixup(obj):
-    """Convert all objects to locale strings"""
-    if isinstance(obj, dict):
-        res = pkcollections.Dict()
-        for k in obj:
-            res[pkcompat.locale_str(k)] = _fixup(obj[k])
-        return res
-    if isinstance(obj, list):
-        res = []
-        for v in obj:
-            res.append(_fixup(v))
-        return res
-    if type(obj) == bytes or type(obj) == str and hasattr(obj, 'decode'):
-        return pkcompat.locale_str(obj)
-    return obj
+    return yaml.load(value, Loader=_Loader)
+
+
+class _Dumper(_BaseDumper):
+    """Writes `pkcollections.Dict` and tuples as plain mappings and lists"""
+    pass
+
+
+class _Loader(_BaseLoader):
+    """Constructs `pkcollections.Dict` and locale strings while parsing
+
+    There is no post-processing pass, and the constructors don't recurse.
+    """
+    pass
+
+
+def _cached(filename, frozen):
+    """Lookup filename in memory, then on disk, then parse"""
+    p = os.path.realpath(str(pkio.py_path(filename)))
+    s = os.stat(p)
+    k = (p, getattr(s, 'st_mtime_ns', s.st_mtime), s.st_size, pickle.HIGHEST_PROTOCOL)
+    c = _cache.get(p)
+    if not c or c[0] != k:
+        v = None
+        b = _cache_read(p, k)
+        if b is None:
+            v = load_str(pkio.read_text(p))
+            b = pickle.dumps(v, pickle.HIGHEST_PROTOCOL)
+            _cache_write(p, k, b)
+        c = [k, b, None]
+        if cfg.cache:
+            _cache[p] = c
+        if v is not None and not frozen:
+            # just parsed so not shared
+            return v
+    if not frozen:
+        return pickle.loads(c[1])
+    if c[2] is None:
+        c[2] = pkcollections.freeze(pickle.loads(c[1]))
+    return c[2]
+
+
+def _cache_path(path):
+    return os.path.join(
+        cfg.cache_dir,
+        hashlib.sha1(path.encode('utf-8')).hexdigest() + '.pickle',
+    )
+
+
+def _cache_read(path, key):
+    """Read pickled value from cfg.cache_dir if key matches
+
+    Returns:
+        bytes: pickled value or None
+    """
+    if not cfg.cache_dir:
+        return None
+    try:
+        with open(_cache_path(path), 'rb') as f:
+            k, v = pickle.load(f)
+        if k == key:
+            return v
+    except Exception:
+        # missing, stale format, or corrupt: parse the file again
+        pass
+    return None
+
+
+def _cache_write(path, key, value):
+    if not cfg.cache_dir:
+        return
+    pkio.mkdir_parent(cfg.cache_dir)
+    with pkio.atomic_open(_cache_path(path), mode='wb') as f:
+        pickle.dump((key, value), f, pickle.HIGHEST_PROTOCOL)
+
+
+def _construct_dict(loader, node):
+    """Build `pkcollections.Dict` directly (same protocol as SafeConstructor)"""
+    res = pkcollections.Dict()
+    # yield first so recursive (aliased) structures work
+    yield res
+    loader.flatten_mapping(node)
+    for k, v in loader.construct_pairs(node):
+        res[pkcompat.locale_str(k)] = v
+
+
+def _construct_str(loader, node):
+    """Convert to locale string (PY2 loader returns str if ASCII)"""
+    return pkcompat.locale_str(loader.construct_scalar(node))
+
+
+_Dumper.add_multi_representer(dict, _Dumper.represent_dict)
+_Dumper.add_representer(tuple, _Dumper.represent_list)
+_Loader.add_constructor(u'tag:yaml.org,2002:map', _construct_dict)
+_Loader.add_constructor(u'tag:yaml.org,2002:str', _construct_str)
+
+cfg = pkconfig.init(
+    cache=(False, pkconfig.parse_bool, 'keep parsed files in memory'),
+    cache_dir=(None, str, 'directory where parsed files are stored as pickles'),
+)
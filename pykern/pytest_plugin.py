@@ -85,7 +85,7 @@ def pytest_runtest_protocol(item, *args, **kwargs):
     pkunit.module_under_test = m
     if is_new:
         from pykern import pkio
-        pkio.unchecked_remove(pkunit.work_dir())
+        pkio.unchecked_remove(pkunit.work_dir(), background=True)
 
 
 def _setup_py_parser():
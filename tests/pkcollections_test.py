@@ -280,3 +280,49 @@ def _random_init():
         order += c
         setattr(n, c, _VALUE)
     return n, list(order)
+
+
+def test_frozen_dict():
+    import copy
+    import pickle
+    from pykern.pkcollections import FrozenDict
+
+    f = FrozenDict(a=1)
+    pkeq(1, f.a)
+    for op in (
+        lambda: f.__setitem__('a', 2),
+        lambda: setattr(f, 'b', 2),
+        lambda: f.update(a=2),
+        lambda: f.pop('a'),
+        lambda: f.clear(),
+    ):
+        with pkexcept(TypeError):
+            op()
+    pkeq(f, pickle.loads(pickle.dumps(f)))
+    pkeq(FrozenDict, type(copy.deepcopy(f)))
+
+
+def test_freeze():
+    from pykern.pkcollections import FrozenDict
+
+    v = {'a': [1, {'b': [2]}], 'c': {}}
+    f = pkcollections.freeze(v)
+    pkeq(FrozenDict, type(f))
+    pkeq((1, {'b': (2,)}), f.a)
+    pkeq(FrozenDict, type(f.a[1]))
+    pkeq(3, pkcollections.freeze(3))
+    v['a'].append(3)
+    pkeq(2, len(f.a))
+
+
+def test_freeze_shared():
+    v = [1]
+    for _ in range(50):
+        # would take 2**50 steps if shared values were walked each time
+        v = {'a': v, 'b': v}
+    f = pkcollections.freeze(v)
+    pkok(f.a is f.b, 'shared values should be frozen once')
+    v = [1]
+    v.append({'x': v})
+    with pkexcept(ValueError):
+        pkcollections.freeze(v)
@@ -9,6 +9,7 @@ import glob
 import os
 import py
 import pytest
+import shutil
 
 
 def test_has_file_extension():
@@ -22,12 +23,25 @@ def test_has_file_extension():
 def test_py_path():
     from pykern import pkunit
     from pykern import pkio
-    from pykern.pkunit import pkeq
+    from pykern.pkunit import pkeq, pkok
 
     with pkunit.save_chdir_work():
         d = pkunit.data_dir()
         pkeq(d, pkio.py_path(d))
-
+        pkeq(py.path.local('a/../b'), pkio.py_path('a/../b'))
+        pkeq(py.path.local('~/x', expanduser=True), pkio.py_path('~/x'))
+    with pkunit.save_chdir_work(is_pkunit_prefix=True) as d:
+        p = pkio.py_path('/p/q')
+        pkeq(d.join('p', 'q'), p)
+        pkok(d.join('p').check(dir=True), 'parent should be created')
+        pkio.unchecked_remove(d.join('p'))
+        pkio.py_path('/p/r')
+        pkok(d.join('p').check(dir=True), 'parent should be created after remove')
+        # removed other ways, too
+        pkio.write_text('/out/a', 'a')
+        shutil.rmtree(str(d.join('out')))
+        pkio.write_text('/out/b', 'b')
+        pkeq('b', pkio.read_text('/out/b'))
 
 
 def test_save_chdir():
@@ -125,3 +139,234 @@ def test_write_text():
             'When write_text is called, it should write "something"'
     assert expect_content == pkio.read_text(str(expect_res)), \
         'When read_text, it should read "something"'
+
+
+def test_write_text_atomic():
+    """atomic write replaces file and leaves no temporary files"""
+    from pykern import pkunit
+    from pykern import pkio
+    from pykern.pkunit import pkeq
+
+    with pkunit.save_chdir_work():
+        fn = 'anything'
+        pkio.write_text(fn, 'old')
+        os.chmod(fn, 0o640)
+        pkio.write_text(fn, 'new', atomic=True, fsync=True)
+        pkeq('new', pkio.read_text(fn))
+        pkeq(0o640, os.stat(fn).st_mode & 0o777)
+        pkeq(['anything'], os.listdir('.'))
+        with pytest.raises(IndentationError):
+            with pkio.atomic_open(fn) as f:
+                f.write(u'partial')
+                raise IndentationError()
+        pkeq('new', pkio.read_text(fn))
+        pkeq(['anything'], os.listdir('.'))
+
+
+def test_iter_tree():
+    from pykern import pkunit
+    from pykern import pkio
+    from pykern.pkunit import pkeq
+    import os
+
+    with pkunit.save_chdir_work() as d:
+        for f in ('a/x', 'a/b/y', 'a/b/z', 'c/x', 'e'):
+            pkio.mkdir_parent_only(f)
+            pkio.write_text(f, '')
+        os.symlink('a', 'l')
+        r = [os.path.relpath(p, str(d)) for p in pkio.iter_tree('.')]
+        pkeq(['a/b/y', 'a/b/z', 'a/x', 'c/x', 'e'], r)
+        r = pkio.iter_tree(d, file_re=r'x$', dir_filter=lambda p: p != 'a/b')
+        pkeq([str(d.join('a/x')), str(d.join('c/x'))], list(r))
+
+
+def test_scan_tree():
+    from pykern import pkunit
+    from pykern import pkio
+    from pykern.pkunit import pkeq
+
+    with pkunit.save_chdir_work() as d:
+        for f in ('a/x', 'a/b/y', 'a/b/z', 'c/x', 'e'):
+            pkio.mkdir_parent_only(f)
+            pkio.write_text(f, f)
+        pkeq(list(pkio.iter_tree('.')), pkio.scan_tree('.', workers=2))
+        r = pkio.scan_tree(d, file_re=r'x$', dir_filter=lambda p: p != 'a/b', stat=True)
+        pkeq([str(d.join('a/x')), str(d.join('c/x'))], [x[0] for x in r])
+        pkeq([3, 3], [x[1].st_size for x in r])
+
+
+def test_read_binary():
+    """Also tests mmap_file and iter_records"""
+    from pykern import pkunit
+    from pykern import pkio
+    from pykern.pkunit import pkeq
+    import array
+
+    with pkunit.save_chdir_work():
+        a = array.array('d', range(100))
+        b = a.tobytes()
+        with open('a', 'wb') as f:
+            f.write(b)
+        pkeq(b, pkio.read_binary('a'))
+        m = pkio.mmap_file('a')
+        try:
+            pkeq(a.tolist(), memoryview(m).cast('d').tolist())
+        finally:
+            m.close()
+        r = list(pkio.iter_records('a', record_size=8, buffer_size=20))
+        pkeq([b[i:i + 8] for i in range(0, len(b), 8)], r)
+        with open('l', 'wb') as f:
+            f.write(b'abc\nd\n\nefgh')
+        pkeq(
+            [b'abc\n', b'd\n', b'\n', b'efgh'],
+            list(pkio.iter_records('l', buffer_size=3)),
+        )
+        with pkio.mmap_file(pkio.write_text('e', '')) as m:
+            pkeq(b'', m[:])
+            pkeq(0, len(memoryview(m)))
+        pkeq(True, m.closed)
+
+
+def test_unchecked_remove_parallel():
+    from pykern import pkunit
+    from pykern import pkio
+    from pykern.pkunit import pkeq, pkok
+    import glob
+    import time
+
+    def _tree(d):
+        for i in range(20):
+            pkio.mkdir_parent('{}/{}/x'.format(d, i))
+            pkio.write_text('{}/{}/x/f'.format(d, i), '')
+            pkio.write_text('{}/f{}'.format(d, i), '')
+
+    with pkunit.save_chdir_work():
+        _tree('p')
+        pkio.unchecked_remove('p', parallel=True)
+        pkok(not os.path.exists('p'), 'parallel remove failed')
+        _tree('b')
+        # left by an interrupted process
+        _tree('.pkio-remove-stale')
+        pkio.unchecked_remove('b', 'not-found', background=True)
+        pkok(not os.path.exists('b'), 'background rename failed')
+        for _ in range(100):
+            if not glob.glob('.pkio-remove-*'):
+                break
+            time.sleep(.1)
+        pkeq([], glob.glob('.pkio-remove-*'))
+        # parent doesn't exist
+        pkio.unchecked_remove('not-found/x', background=True)
+        if os.geteuid() != 0:
+            # parent isn't writable, so can't rename or remove
+            _tree('r/b')
+            os.chmod('r', 0o555)
+            try:
+                pkio.unchecked_remove('r/b', background=True)
+            finally:
+                os.chmod('r', 0o755)
+            pkok(os.path.exists('r/b'), 'unwritable parent removed')
+
+
+def test_hash_tree():
+    """Also tests hash_file"""
+    from pykern import pkunit
+    from pykern import pkio
+    from pykern.pkunit import pkeq, pkok
+    import hashlib
+
+    with pkunit.save_chdir_work():
+        pkio.mkdir_parent('t/d')
+        pkio.write_text('t/a', 'a')
+        pkio.write_text('t/d/b', 'b')
+        pkeq(hashlib.sha256(b'a').hexdigest(), pkio.hash_file('t/a', buffer_size=1))
+        h, c = pkio.hash_tree('t')
+        pkeq(['a', 'd/b'], c)
+        pkok(os.path.exists('t/' + pkio.HASH_CACHE_BASENAME), 'cache not written')
+        pkeq((h, []), pkio.hash_tree('t', workers=4))
+        pkio.write_text('t/d/b', 'c')
+        pkio.write_text('t/e', 'e')
+        os.remove('t/a')
+        h2, c = pkio.hash_tree('t', workers=4)
+        pkeq(['a', 'd/b', 'e'], c)
+        pkok(h != h2, 'tree hash should change')
+        pkeq(h2, pkio.hash_tree('t', cache=False)[0])
+        # symlinks are keyed on the target
+        pkio.write_text('target', 'x')
+        os.symlink('../target', 't/l')
+        h, c = pkio.hash_tree('t')
+        pkeq(['l'], c)
+        pkio.write_text('target', 'xy')
+        pkeq(['l'], pkio.hash_tree('t')[1])
+        # dangling symlinks are skipped
+        os.symlink('../not-found', 't/dangling')
+        pkeq([], pkio.hash_tree('t')[1])
+        # corrupt or incomplete cache is ignored
+        for x in ('{', '{"algorithm": "sha256"}', '{"algorithm": "sha256", "files": {"e": [1]}}'):
+            pkio.write_text('t/' + pkio.HASH_CACHE_BASENAME, x)
+            pkeq(['d/b', 'e', 'l'], pkio.hash_tree('t')[1])
+        if os.geteuid() != 0:
+            # cache isn't written in read-only trees
+            os.remove('t/' + pkio.HASH_CACHE_BASENAME)
+            os.chmod('t', 0o555)
+            try:
+                pkeq(['d/b', 'e', 'l'], pkio.hash_tree('t')[1])
+            finally:
+                os.chmod('t', 0o755)
+
+
+def test_glob_tree():
+    from pykern import pkunit
+    from pykern import pkio
+    from pykern.pkunit import pkeq
+
+    with pkunit.save_chdir_work() as d:
+        for f in ('a.py', 'b.txt', 'x/c.py', 'x/y/d.py', 'x/y/e.yml', 'build/f.py', 'x/[g].py'):
+            pkio.mkdir_parent_only(f)
+            pkio.write_text(f, '')
+
+        def _rel(res):
+            return [d.bestrelpath(p) for p in res]
+
+        pkeq(['a.py', 'build/f.py', 'x/[g].py', 'x/c.py', 'x/y/d.py'], _rel(pkio.glob_tree('.', '**/*.py')))
+        pkeq(
+            ['b.txt', 'x/c.py', 'x/y/e.yml'],
+            _rel(pkio.glob_tree(d, ['*.txt', '**/*.yml', 'x/[a-c].py'])),
+        )
+        pkeq(
+            ['a.py', 'x/y/d.py'],
+            sorted(_rel(pkio.glob_tree('.', '**/*.py', exclude=['build', 'x/*.py'], lazy=True))),
+        )
+        pkeq(['x/[g].py'], _rel(pkio.glob_tree('.', 'x/[[]g].py')))
+        pkeq(['a.py', 'b.txt'], _rel(pkio.glob_tree('.', ['[!]]*.py', '[]b]*.txt', '[!]]x'])))
+
+
+def test_sync_tree():
+    """Also tests copy_file"""
+    from pykern import pkunit
+    from pykern import pkio
+    from pykern.pkunit import pkeq
+
+    with pkunit.save_chdir_work():
+        pkio.mkdir_parent('s/d')
+        pkio.write_text('s/a', 'a' * 100000)
+        pkio.write_text('s/d/b', 'b')
+        os.chmod('s/d/b', 0o751)
+        pkeq(100000, pkio.copy_file('s/a', 'c'))
+        pkeq('a' * 100000, pkio.read_text('c'))
+        p = []
+        pkeq(
+            ['a', 'd/b'],
+            pkio.sync_tree('s', 't', workers=2, progress=lambda *a: p.append(a)),
+        )
+        pkeq(100001, p[-1][1])
+        pkeq('b', pkio.read_text('t/d/b'))
+        pkeq(0o751, os.stat('t/d/b').st_mode & 0o777)
+        pkeq([], pkio.sync_tree('s', 't'))
+        pkio.write_text('s/d/b', 'c')
+        pkeq(['d/b'], pkio.sync_tree('s', 't'))
+        pkeq('c', pkio.read_text('t/d/b'))
+        # symlinks compare by target, and dangling ones are skipped
+        os.symlink('d/b', 's/l')
+        os.symlink('not-found', 's/dangling')
+        pkeq(['l'], pkio.sync_tree('s', 't'))
+        pkeq([], pkio.sync_tree('s', 't'))
@@ -9,6 +9,7 @@ from __future__ import absolute_import, division, print_function
 import glob
 import os.path
 
+import jinja2
 import pytest
 
 from pykern import pkio
@@ -29,3 +30,76 @@ def test_render_resource():
             'render_resource should return string even when writing to file'
         assert expect == pkio.read_text(out), \
             'With out, render_resource should write file'
+
+
+def test_render_file_cache():
+    """Templates are compiled once and recompiled when changed"""
+    from pykern.pkunit import pkeq, pkok
+
+    with pkunit.save_chdir_work():
+        pkio.write_text('t.jinja', '{{ a }}\n')
+        pkeq('1\n', pkjinja.render_file('t.jinja', {'a': 1}))
+        t = pkjinja._templates
+        k = list(t.keys())
+        pkeq('2\n', pkjinja.render_file('t.jinja', {'a': 2}))
+        pkeq(k, list(t.keys()))
+        c = t[k[-1]][1]
+        pkjinja.render_file('t.jinja', {'a': 3})
+        pkok(c is t[k[-1]][1], 'template should not be recompiled')
+        pkio.write_text('t.jinja', 'x{{ a }}\n')
+        pkeq('x4\n', pkjinja.render_file('t.jinja', {'a': 4}))
+
+
+def test_bytecode_cache():
+    """Compiled templates are shared through the bytecode cache"""
+    from pykern.pkunit import pkeq, pkok
+
+    c = pkjinja.cfg.bytecode_cache_dir
+    try:
+        with pkunit.save_chdir_work() as d:
+            pkjinja.cfg.bytecode_cache_dir = str(d.join('bcc'))
+            pkio.write_text('t.jinja', '{{ a }}\n')
+            pkeq('1\n', pkjinja.render_file('t.jinja', {'a': 1}))
+            x = d.join('bcc').listdir()
+            pkeq(1, len(x))
+            pkok(jinja2.__version__ in x[0].basename, '{}: jinja2 version not in name', x[0])
+            pkjinja._templates.clear()
+            pkeq('2\n', pkjinja.render_file('t.jinja', {'a': 2}))
+            pkio.write_text('t.jinja', 'x{{ a }}\n')
+            pkeq('x3\n', pkjinja.render_file('t.jinja', {'a': 3}))
+    finally:
+        pkjinja.cfg.bytecode_cache_dir = c
+        pkjinja._bytecode_cache = None
+        pkjinja._templates.clear()
+
+
+def test_render_file_stream():
+    from pykern.pkunit import pkeq
+
+    with pkunit.save_chdir_work():
+        pkio.write_text('t.jinja', '{% for i in range(n) %}{{ i }}\n{% endfor %}')
+        e = ''.join('{}\n'.format(i) for i in range(1000))
+        pkeq(len(e), pkjinja.render_file('t.jinja', {'n': 1000}, output='out', stream=True))
+        pkeq(e, pkio.read_text('out'))
+        # output untouched on error
+        pkio.write_text('s.jinja', '{{ a }}{{ b }}')
+        with pkunit.pkexcept('is undefined'):
+            pkjinja.render_file('s.jinja', {'a': 1}, output='out', strict_undefined=True, stream=True)
+        pkeq(e, pkio.read_text('out'))
+
+
+def test_render_many():
+    from pykern.pkunit import pkeq
+
+    with pkunit.save_chdir_work():
+        pkio.write_text('t.jinja', '{{ a }}\n')
+        pkio.write_text('bad.jinja', '{{ a }\n')
+        for p in False, True:
+            jobs = [({'a': i}, 'out{}'.format(i)) for i in range(20)]
+            pkeq([], pkjinja.render_many('t.jinja', jobs, workers=4, processes=p))
+            for i in range(20):
+                pkeq('{}\n'.format(i), pkio.read_text('out{}'.format(i)))
+            jobs.insert(3, ({'a': 1}, 'bad', 'bad.jinja'))
+            err = pkjinja.render_many('t.jinja', jobs, processes=p)
+            pkeq(['bad'], [e[0] for e in err])
+            pkeq(False, os.path.exists('bad'))
@@ -17,3 +17,174 @@ def test_load_any():
     j = json.dumps(['a', 'b'])
     j2 = pkjson.load_any(j)
     pkeq('a', j2[0])
+
+
+def test_backends():
+    """Backends produce the same Dict trees and compare throughput"""
+    import json
+    import math
+    import time
+    from pykern import pkcollections
+    from pykern import pkjson
+    from pykern.pkdebug import pkdp
+    from pykern.pkunit import pkeq, pkok
+
+    # Shaped like a simulation document: models with long lists of elements
+    d = {
+        'models': {
+            'beamline': [
+                {'id': i, 'type': 'drift', 'l': i * 0.1, 'name': 'D{}'.format(i)}
+                for i in range(20000)
+            ],
+            'values': {'nested': [[{'x': 1}]]},
+        },
+    }
+    s = json.dumps(d)
+    prev = pkjson.backend
+    try:
+        # Comparing throughput needs an orjson which decodes integers over
+        # 64 bits exactly; otherwise only json is timed.
+        for b in pkjson.BACKENDS:
+            try:
+                pkjson.set_backend(b)
+            except (ImportError, ValueError):
+                # orjson not installed or not exact for large integers
+                continue
+            t = time.time()
+            r = pkjson.load_any(s)
+            t = time.time() - t
+            # dump_pretty always uses the stdlib encoder
+            u = time.time()
+            x = pkjson.dump_pretty(r, pretty=False)
+            u = time.time() - u
+            pkdp(
+                '{}: load {:.1f} MB/s dump {:.1f} MB/s',
+                b,
+                len(s) / t / 1e6 if t else 0,
+                len(x) / u / 1e6 if u else 0,
+            )
+            pkeq(d, json.loads(x))
+            pkeq(pkcollections.Dict, type(r.models['values'].nested[0][0]))
+            pkeq(pkcollections.Dict, type(r.models.beamline[-1]))
+            pkeq(d, r)
+            # falls back to stdlib for non-standard JSON
+            pkok(math.isnan(pkjson.load_any('[NaN]')[0]), '{}: NaN not parsed', b)
+            for i in 2 ** 64, -2 ** 63 - 1:
+                x = pkjson.load_any('{{"i": {}}}'.format(i)).i
+                pkok(type(x) is int, '{}: {} decoded as {}', b, i, type(x))
+                pkeq(i, x)
+    finally:
+        pkjson.set_backend(prev)
+
+
+def test_lines():
+    """Write and read JSON Lines, compressed and not"""
+    from pykern import pkcollections
+    from pykern import pkjson
+    from pykern import pkunit
+    from pykern.pkunit import pkeq
+
+    expect = [{'step': i, 'values': [i, i * 2]} for i in range(100)]
+    with pkunit.save_chdir_work():
+        for fn in ('h.jsonl', 'h.jsonl.gz', 'h.jsonl.xz'):
+            with pkjson.LinesWriter(fn, buffer_size=100) as w:
+                for r in expect[:50]:
+                    w.write(r)
+            # appends to an existing file (new compressed stream)
+            with pkjson.LinesWriter(fn) as w:
+                for r in expect[50:]:
+                    w.write(r)
+            actual = list(pkjson.iter_lines(fn))
+            pkeq(expect, actual)
+            pkeq(pkcollections.Dict, type(actual[0]))
+
+
+def test_iter_events():
+    """Incremental parse matches load_any"""
+    import io
+    import json
+    from pykern import pkcollections
+    from pykern import pkjson
+    from pykern import pkunit
+    from pykern.pkunit import pkeq
+
+    d = {
+        'models': {
+            'beamline': [{'name': u'Dé{}'.format(i), 'l': i * 1.5e-3} for i in range(10)],
+            'empty': [],
+        },
+        'n': [-12345678901234567890, None, True, {}],
+    }
+    with pkunit.save_chdir_work():
+        fn = pkunit.work_dir().join('doc.json')
+        fn.write(json.dumps(d, indent=1, ensure_ascii=False).encode('utf-8'), 'wb')
+        # small chunks split tokens and multibyte chars
+        e = list(pkjson.iter_events(fn, chunk_size=3))
+        pkeq(('models.beamline[0].name', u'Dé0'), e[0])
+        pkeq(('models.empty', []), e[20])
+        pkeq(('n[3]', {}), e[-1])
+        s = list(pkjson.iter_select(fn, 'models.beamline[*]', chunk_size=5))
+        pkeq(d['models']['beamline'], [v for _, v in s])
+        pkeq('models.beamline[9]', s[-1][0])
+        pkeq(pkcollections.Dict, type(s[0][1]))
+        pkeq([('n', d['n'])], list(pkjson.iter_select(fn, '*', chunk_size=5))[1:])
+        # keys which would make paths ambiguous are escaped
+        x = io.StringIO(u'{"": {"b": 1}, "a.b": {"[c]": 2}, "\\\\": 3}')
+        pkeq(
+            [('.b', 1), (r'a\.b.\[c\]', 2), ('\\\\', 3)],
+            list(pkjson.iter_events(x)),
+        )
+        x.seek(0)
+        pkeq(
+            [(r'a\.b', {'[c]': 2}), ('\\\\', 3)],
+            list(pkjson.iter_select(x, '*')),
+        )
+        x.seek(0)
+        pkeq([(r'a\.b.\[c\]', 2)], list(pkjson.iter_select(x, r'a\.b.*')))
+        with pkunit.pkexcept(ValueError):
+            list(pkjson.iter_events(io.StringIO(u'[1,]')))
+
+
+def test_canonical_hash():
+    """Hash is independent of key order, type of dict, and freezing"""
+    from pykern import pkjson
+    from pykern.pkcollections import Dict, FrozenDict
+    from pykern.pkunit import pkeq, pkexcept, pkok
+
+    a = {
+        'models': {'beamline': [{'l': 1.5, 'v': [1, 2]}, {'name': u'é'}]},
+        'n': [None, True, [1e300, -3]],
+    }
+    h = pkjson.canonical_hash(a)
+    b = Dict(
+        n=(None, True, (1e300, -3)),
+        models=Dict(beamline=[Dict(v=[1, 2], l=1.5), Dict(name=u'é')]),
+    )
+    pkeq(h, pkjson.canonical_hash(b))
+    f = FrozenDict(
+        n=(None, True, (1e300, -3)),
+        models=FrozenDict(beamline=(FrozenDict(v=(1, 2), l=1.5), FrozenDict(name=u'é'))),
+    )
+    pkeq(h, pkjson.canonical_hash(f))
+    # memoized result is used
+    pkok(f.models.__dict__.get('_pkjson_canonical_hash'), 'deep-frozen sub-tree not memoized')
+    pkeq(h, pkjson.canonical_hash(f))
+    pkeq(h, pkjson.canonical_hash(pkjson.load_any(pkjson.dump_pretty(a))))
+    b.models.beamline[0].l = 1.50001
+    pkok(h != pkjson.canonical_hash(b), 'hash should change when value changes')
+    pkok(
+        pkjson.canonical_hash([1, [2]]) != pkjson.canonical_hash([[1], 2]),
+        'hash should reflect structure',
+    )
+    with pkexcept(TypeError):
+        pkjson.canonical_hash({1: 2})
+    # not memoized if sub-tree is mutable
+    for c in Dict(x=Dict(y=1)), FrozenDict(x=[1]):
+        f = FrozenDict(a=FrozenDict(c=c, d=FrozenDict(e=1)))
+        h = pkjson.canonical_hash(f)
+        if isinstance(c, FrozenDict):
+            c.x.append(2)
+        else:
+            c.x.y = 2
+        pkok(h != pkjson.canonical_hash(f), '{}: mutated child should change hash', c)
+        pkeq(pkjson.canonical_hash(pkjson.load_any(pkjson.dump_pretty(f))), pkjson.canonical_hash(f))
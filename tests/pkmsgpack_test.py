@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+u"""test pkmsgpack
+
+:copyright: Copyright (c) 2018 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+import array
+import pytest
+
+
+def test_round_trip():
+    """Pure Python and msgpack backends agree"""
+    from pykern import pkcollections
+    from pykern import pkmsgpack
+    from pykern.pkunit import pkeq
+
+    d = {
+        'models': {'beamline': [{'l': 1.5, 'n': -70000}, {}], 'empty': []},
+        's': u'é' * 40,
+        'b': b'\x00' * 300,
+        'v': [None, True, False, 2 ** 63, -2 ** 40],
+        'x': array.array('d', [1.5, 2.5]),
+    }
+    prev = pkmsgpack.set_backend()
+    try:
+        for b in ('python', 'msgpack'):
+            try:
+                pkmsgpack.set_backend(b)
+            except ImportError:
+                continue
+            e = pkmsgpack.dump_bytes(d)
+            r = pkmsgpack.load_any(e)
+            pkeq(pkcollections.Dict, type(r.models.beamline[0]))
+            pkeq(memoryview, type(r.x))
+            pkeq([1.5, 2.5], r.x.tolist())
+            pkeq(d['x'], pkmsgpack.load_any(e, copy_arrays=True).x)
+            del r['x']
+            pkeq(dict((k, v) for k, v in d.items() if k != 'x'), r)
+    finally:
+        pkmsgpack.set_backend(prev)
+
+
+def test_reencode_typed_buffers():
+    """Decoded arrays (typed memoryviews) can be encoded again"""
+    from pykern import pkmsgpack
+    from pykern.pkunit import pkeq
+
+    d = {'x': array.array('i', [1, -2, 3]), 'y': [array.array('d', [0.5])], 'b': b'ab'}
+    prev = pkmsgpack.set_backend()
+    try:
+        for b in ('python', 'msgpack'):
+            try:
+                pkmsgpack.set_backend(b)
+            except ImportError:
+                continue
+            r = pkmsgpack.load_any(pkmsgpack.dump_bytes(d))
+            r = pkmsgpack.load_any(pkmsgpack.dump_bytes(r))
+            pkeq(memoryview, type(r.x))
+            pkeq('i', r.x.format)
+            pkeq([1, -2, 3], r.x.tolist())
+            pkeq([0.5], r.y[0].tolist())
+            pkeq(b'ab', r.b)
+            pkeq(
+                [1, -2, 3],
+                pkmsgpack.load_any(pkmsgpack.dump_bytes(r.x)).tolist(),
+            )
+    finally:
+        pkmsgpack.set_backend(prev)
+
+
+def test_typecodes():
+    """Platform dependent item sizes are converted or rejected"""
+    from pykern import pkmsgpack
+    from pykern.pkunit import pkeq, pkexcept
+
+    prev = pkmsgpack.set_backend()
+    try:
+        for b in ('python', 'msgpack'):
+            try:
+                pkmsgpack.set_backend(b)
+            except ImportError:
+                continue
+            for t, e in ('l', 'iq'), ('L', 'IQ'):
+                r = pkmsgpack.load_any(pkmsgpack.dump_bytes({'x': array.array(t, [1, 2])}))
+                # "q" if long is 64 bits
+                pkeq(e[array.array(t).itemsize == 8], r.x.format)
+                pkeq([1, 2], r.x.tolist())
+            with pkexcept(TypeError):
+                pkmsgpack.dump_bytes({'x': array.array('u', u'ab')})
+    finally:
+        pkmsgpack.set_backend(prev)
+
+
+def test_file_extension():
+    from pykern import pkmsgpack
+    from pykern import pkunit
+    from pykern.pkunit import pkeq
+
+    with pkunit.save_chdir_work():
+        d = {'a': [1, 2]}
+        pkmsgpack.dump_file(d, 'x.json')
+        pkmsgpack.dump_file(d, 'x.msgpack')
+        pkeq('{', open('x.json').read(1))
+        for f in ('x.json', 'x.msgpack'):
+            pkeq(d, pkmsgpack.load_file(f))
@@ -36,3 +36,77 @@ def test_filename():
         pkresource.filename('somefile', pkresource)
     assert pkresource.filename('somefile', t1.somefile), \
         'Given any object, should fine resource in root package of that object'
+
+
+def test_filename_cache():
+    from pykern.pkunit import pkeq
+
+    n = pkresource.filename('test.yml', pkresource)
+    pkeq(n, pkresource._cache[('pykern', 'test.yml')])
+
+
+def test_read_tree():
+    from pykern import pkio
+    from pykern.pkunit import pkeq
+    import hashlib
+    import json
+
+    n = pkresource.filename('projex-licenses/mit.jinja', pkresource)
+    with open(n, 'rb') as f:
+        b = f.read()
+    pkeq(len(b), pkresource.manifest(pkresource)['projex-licenses/mit.jinja'][0])
+    pkeq(b, pkresource.read_tree('projex-licenses', pkresource)['mit.jinja'])
+    m = pkresource.mmap_file('projex-licenses/mit.jinja', pkresource)
+    try:
+        pkeq(b, m[:])
+    finally:
+        m.close()
+    with pkunit.save_chdir_work():
+        pkio.mkdir_parent('d/e')
+        pkio.write_text('d/e/f', 'x')
+        f = pkresource.write_manifest('d', ['d/e/f'])
+        with open(f) as x:
+            j = json.load(x)
+        pkeq([1, hashlib.sha256(b'x').hexdigest()], j['files']['e/f'])
+
+
+def test_read_tree_stale_manifest():
+    from pykern import pkio
+    from pykern.pkunit import pkeq, pkok
+    import importlib
+    import sys
+
+    with pkunit.save_chdir_work() as d:
+        pd = 'pkresource_stale/package_data'
+        pkio.mkdir_parent(pd)
+        pkio.write_text('pkresource_stale/__init__.py', '')
+        # Like an installer: the manifest is not the last file written
+        pkio.write_text(pd + '/a', 'abc')
+        pkresource.write_manifest(pd, [pd + '/a'])
+        pkio.write_text(pd + '/b', 'b')
+        pkresource.write_manifest(pd, [pd + '/a', pd + '/b'])
+        pkio.write_text(pd + '/z', 'z')
+        pkresource.write_manifest(pd, [pd + '/a', pd + '/b', pd + '/z'])
+        sys.path.insert(0, str(d))
+        try:
+            m = importlib.import_module('pkresource_stale')
+            pkok(pkresource.manifest(m)['a'][1], 'manifest not used')
+            pkio.write_text(pd + '/a', 'abcdef-edited')
+            pkresource._manifests.clear()
+            e = {'a': b'abcdef-edited', 'b': b'b', 'z': b'z'}
+            pkeq(e, pkresource.read_tree('', m))
+            pkeq(None, pkresource.manifest(m)['a'][1])
+            # walked listing is cached, too
+            pkio.write_text(pd + '/new', 'n')
+            pkeq(e, pkresource.read_tree('', m))
+            pkresource._manifests.clear()
+            e['new'] = b'n'
+            pkeq(e, pkresource.read_tree('', m))
+            # source trees ignore the manifest
+            pkresource.write_manifest(pd, [pd + '/' + x for x in e])
+            pkresource._manifests.clear()
+            pkio.write_text('setup.py', '')
+            pkeq(None, pkresource.manifest(m)['a'][1])
+        finally:
+            sys.path.remove(str(d))
+            pkresource._manifests.clear()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+u"""pytest for `pykern.pkwatch`
+
+:copyright: Copyright (c) 2018 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+
+
+def test_watcher():
+    from pykern import pkio
+    from pykern import pkunit
+    from pykern import pkwatch
+    from pykern.pkunit import pkeq
+    import os
+
+    for poll in False, True:
+        with pkunit.save_chdir_work() as d:
+            pkio.write_text('m', '')
+            pkio.write_text('r', '')
+            with pkwatch.Watcher(d, poll=poll, poll_interval=0.05, debounce=0.2) as w:
+                pkeq([], w.read(timeout=0.1))
+                pkio.write_text('a', 'x')
+                pkio.write_text('a', 'xy')
+                pkio.write_text('m', 'x')
+                os.remove('r')
+                pkio.mkdir_parent('s/t')
+                pkio.write_text('s/t/u', 'x')
+                pkio.write_text('tmp', '')
+                os.remove('tmp')
+                e = w.read(timeout=5)
+                pkeq(
+                    sorted([
+                        ('create', str(d.join('a'))),
+                        ('modify', str(d.join('m'))),
+                        ('delete', str(d.join('r'))),
+                        ('create', str(d.join('s/t/u'))),
+                    ]),
+                    sorted(e),
+                )
+                pkeq('poll' if poll else 'inotify', w.backend)
+
+
+def test_asyncio_queue():
+    from pykern import pkio
+    from pykern import pkunit
+    from pykern import pkwatch
+    from pykern.pkunit import pkeq
+    import asyncio
+
+    with pkunit.save_chdir_work() as d:
+        with pkwatch.Watcher(d, poll_interval=0.05) as w:
+            l = asyncio.new_event_loop()
+            q = w.asyncio_queue(l)
+            pkio.write_text('a', 'x')
+            e = l.run_until_complete(asyncio.wait_for(q.get(), 5))
+            l.close()
+            pkeq(('create', str(d.join('a'))), e)
+
+
+def test_move_dir():
+    from pykern import pkio
+    from pykern import pkunit
+    from pykern import pkwatch
+    from pykern.pkunit import pkeq
+    import os
+
+    for poll in False, True:
+        with pkunit.save_chdir_work() as d:
+            pkio.mkdir_parent('w/s/t')
+            pkio.write_text('w/s/t/u', '')
+            pkio.mkdir_parent('w/r')
+            pkio.write_text('w/r/a', '')
+            with pkwatch.Watcher('w', poll=poll, poll_interval=0.05, debounce=0.2) as w:
+                os.rename('w/s', 'out')
+                os.rename('w/r', 'w/q')
+                pkeq(
+                    sorted([
+                        ('delete', str(d.join('w/s/t/u'))),
+                        ('delete', str(d.join('w/r/a'))),
+                        ('create', str(d.join('w/q/a'))),
+                    ]),
+                    sorted(w.read(timeout=5)),
+                )
+                pkio.write_text('out/t/v', '')
+                pkio.write_text('w/q/b', '')
+                pkeq(
+                    [('create', str(d.join('w/q/b')))],
+                    w.read(timeout=5),
+                )
+
+
+def test_close_wakes_read():
+    from pykern import pkunit
+    from pykern import pkwatch
+    from pykern.pkunit import pkeq, pkok
+    import threading
+
+    for poll in False, True:
+        with pkunit.save_chdir_work() as d:
+            w = pkwatch.Watcher(d, poll=poll, poll_interval=0.05)
+            res = []
+            t = threading.Thread(target=lambda: res.append(w.read()))
+            t.daemon = True
+            t.start()
+            t.join(0.2)
+            w.close()
+            t.join(5)
+            pkok(not t.is_alive(), 'poll={}: read not woken by close', poll)
+            pkeq([[]], res)
+
+
+def test_max_delay():
+    from pykern import pkio
+    from pykern import pkunit
+    from pykern import pkwatch
+    from pykern.pkunit import pkeq, pkok
+    import threading
+    import time
+
+    for poll in False, True:
+        with pkunit.save_chdir_work() as d:
+            done = threading.Event()
+
+            def _write():
+                # bounded so the test fails rather than hangs
+                end = time.time() + 5
+                while time.time() < end and not done.wait(0.05):
+                    pkio.write_text('a', str(time.time()))
+
+            t = threading.Thread(target=_write)
+            t.daemon = True
+            with pkwatch.Watcher(d, poll=poll, poll_interval=0.02, max_delay=0.3) as w:
+                t.start()
+                try:
+                    s = time.time()
+                    e = w.read(timeout=0.5)
+                    s = time.time() - s
+                finally:
+                    done.set()
+                    t.join()
+                pkok(s < 2, 'poll={}: read took {} with continuous writes', poll, s)
+                pkeq(str(d.join('a')), e[0].path)
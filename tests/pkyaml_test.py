@@ -40,3 +40,90 @@ def _assert_unicode(value):
     elif type(value) == str:
         assert isinstance(value, unicode), \
             '{}: value is not unicode'.format(value)
+
+
+def test_load_large():
+    """pkyaml (C loader, if available) matches yaml.SafeLoader on a 0.3 MB document"""
+    import yaml
+    from pykern import pkcollections
+    from pykern import pkio
+    from pykern.pkunit import pkeq
+
+    with pkunit.save_chdir_work():
+        d = {
+            'models': {
+                'beamline': [
+                    {'id': i, 'type': 'drift', 'l': i * 0.1, 'name': 'D{}'.format(i)}
+                    for i in range(5000)
+                ],
+            },
+        }
+        fn = pkio.write_text('big.yml', yaml.safe_dump(d))
+        y = pkyaml.load_file(fn)
+        pkeq(yaml.load(pkio.read_text(fn), Loader=yaml.SafeLoader), y)
+        pkeq(pkcollections.Dict, type(y.models.beamline[-1]))
+
+
+def test_load_deep():
+    """No recursion in post-processing for deeply nested documents"""
+    from pykern import pkcollections
+    from pykern.pkunit import pkeq
+
+    n = 3000
+    y = pkyaml.load_str('\n'.join('  ' * i + 'k{}:'.format(i) for i in range(n)) + ' v')
+    for i in range(n - 1):
+        pkeq(pkcollections.Dict, type(y))
+        y = y['k{}'.format(i)]
+    pkeq('v', y['k{}'.format(n - 1)])
+
+
+def test_load_file_cache():
+    """Cache is invalidated by mtime/size and survives via cache_dir"""
+    from pykern import pkcollections
+    from pykern import pkio
+    from pykern.pkunit import pkeq, pkexcept, pkok
+
+    prev = (pkyaml.cfg.cache, pkyaml.cfg.cache_dir, pkyaml.load_str)
+    with pkunit.save_chdir_work() as d:
+        try:
+            pkyaml.cfg.cache = True
+            pkyaml.cfg.cache_dir = str(d.join('cache'))
+            fn = pkio.write_text('c.yml', 'a: [1, {b: c}]\n')
+            y = pkyaml.load_file(fn)
+            y.a.append(2)
+            pkeq([1, {'b': 'c'}], pkyaml.load_file(fn).a)
+            f = pkyaml.load_file(fn, frozen=True)
+            pkok(f is pkyaml.load_file(fn, frozen=True), 'frozen value is shared')
+            pkeq(pkcollections.FrozenDict, type(f.a[1]))
+            with pkexcept(TypeError):
+                f.a[1]['b'] = 'x'
+            pkio.write_text(fn, 'a: changed\n')
+            pkeq('changed', pkyaml.load_file(fn).a)
+            # cold process: memory cache empty, read from cache_dir
+            pkyaml._cache.clear()
+            pkyaml.load_str = None
+            pkeq('changed', pkyaml.load_file(fn).a)
+        finally:
+            pkyaml._cache.clear()
+            pkyaml.cfg.cache, pkyaml.cfg.cache_dir, pkyaml.load_str = prev
+
+
+def test_iter_file():
+    """Stream multiple documents out and back in"""
+    from pykern import pkcollections
+    from pykern.pkunit import pkeq
+
+    with pkunit.save_chdir_work():
+        n = 100
+        fn = pkyaml.dump_iter(
+            (pkcollections.Dict(step=i, v=(i, {'x': u'é'})) for i in range(n)),
+            'stream.yml',
+        )
+        i = 0
+        for y in pkyaml.iter_file(fn):
+            pkeq(pkcollections.Dict, type(y))
+            pkeq(i, y.step)
+            pkeq([i, {'x': u'é'}], y.v)
+            i += 1
+        pkeq(n, i)
+        pkeq([1, [2]], list(pkyaml.iter_str('--- 1\n--- [2]\n')))